@@ -1,20 +1,84 @@
 import time
 from typing import *
 
+import asyncio
+
+import concurrent.futures
 import discord
 from config import *
+import itertools
 import json
 import os
+import sys
+import threading
+import weakref
 from log import *
+from metrics import metrics
+from cache import LRUCache
+from index import Completions, Orders, SearchIndex, intersect
+from storage import Storage, Writer
 import utils
 
 
+# message versions, unique across all users so a removed and
+# bookmarked again message does not reuse an old version
+VERSIONS = itertools.count(1)
+
+
+# search budgets
+
+class SearchCancelled(Exception):
+    '''
+    Raised in a search that ran out of time or was cancelled.
+    '''
+
+
+class SearchBudget:
+    def __init__(self, seconds:float):
+        '''
+        Time a search can take.
+
+        Searches call `check` between filters and stop there,
+        a thread can't be stopped from the outside.
+        '''
+        self.seconds: float = seconds
+        self.deadline: float = time.perf_counter()+seconds
+        self.cancelled: bool = False
+
+
+    def restart(self):
+        '''
+        Starts counting the time again.
+        '''
+        self.deadline = time.perf_counter()+self.seconds
+
+
+    def cancel(self):
+        '''
+        Makes the search stop at the next check.
+        '''
+        self.cancelled = True
+
+
+    def check(self):
+        '''
+        Raises SearchCancelled if the search has to stop.
+        '''
+        if self.cancelled or time.perf_counter() > self.deadline:
+            raise SearchCancelled
+
+
 # handling args
 
-def handle_arg(arg: str, value: str, messages:"List[Message]", case:bool) -> List[int]:
+def handle_arg(
+    arg: str, value: str, messages:"List[Message]", case:bool,
+    search_index:"SearchIndex | None"=None
+) -> List[int]:
     '''
     Searches the given list of messages following the given rule.
 
+    If an index is passed, it is used to narrow down the messages to check.
+
     Returns a list of message IDs.
     '''
     arg = arg.lower()
@@ -41,14 +105,29 @@ def handle_arg(arg: str, value: str, messages:"List[Message]", case:bool) -> Lis
             out += i
 
     value = out
+    folded = value if case else value.casefold()
+
+    # relative dates are resolved once, so the index and the check agree
+    if arg in DATE_ARGS:
+        timestamp = utils.parse_time(value)
+        if timestamp == None:
+            return []
+        value = repr(timestamp)
+
+    # narrowing down
+    if search_index != None:
+        candidates = search_index.candidates(arg, value)
+
+        if candidates != None and len(candidates) < len(messages):
+            messages = candidates
 
     # keyword
     if arg in ['keyword', 'kw']:
         return [
-            m.id for m in messages if value in (
-                m.text if case else m.text.lower()
-            ) or value in (
-                m.note if case else m.note.lower()
+            m.id for m in messages if folded in (
+                m.text if case else m.folded_text
+            ) or folded in (
+                m.note if case else m.folded_note
             ) or value.lower().replace(' ','_') in (
                 m.tags
             )
@@ -57,16 +136,16 @@ def handle_arg(arg: str, value: str, messages:"List[Message]", case:bool) -> Lis
     # text
     if arg == 'text':
         return [
-            m.id for m in messages if value in (
-                m.text if case else m.text.lower()
+            m.id for m in messages if folded in (
+                m.text if case else m.folded_text
             )
         ]
 
     # note
     if arg == 'note':
         return [
-            m.id for m in messages if value in (
-                m.note if case else m.note.lower()
+            m.id for m in messages if folded in (
+                m.note if case else m.folded_note
             )
         ]
 
@@ -160,22 +239,76 @@ def handle_arg(arg: str, value: str, messages:"List[Message]", case:bool) -> Lis
     
     # by user
     if arg in ['by','from','author']:
-        value = value.lower().replace(' ','_')
+        value = value.casefold().replace(' ','_')
         value = value.removeprefix('<@').removesuffix('>')
 
         out = []
 
         for i in messages:
-            if i.author_name.lower() == value\
+            if i.folded_author == value\
             or str(i.author_id) == value:
                 out.append(i.id)
 
         return out
     
+    # dates
+    if arg in DATE_ARGS:
+        timestamp = float(value)
+        saved = arg.startswith('saved')
+
+        if arg.endswith('before'):
+            return [
+                m.id for m in messages if (m.saved_at if saved else m.sent_at) < timestamp
+            ]
+
+        return [
+            m.id for m in messages if (m.saved_at if saved else m.sent_at) >= timestamp
+        ]
+
     # nope
     return []
 
 
+def parse_prompt(prompt:str) -> List[Tuple[str, str]]:
+    '''
+    Splits a search prompt into a list of filters.
+
+    Words that are not arguments are joined into keyword filters.
+
+    Returns a list of (argument, value) pairs.
+    '''
+    codes = prompt.split(' ')
+    plan: List[Tuple[str, str]] = []
+
+    kw: List[str] = []
+    current_kw: str = ''
+    arg = None
+
+    for i in codes:
+        if arg != None:
+            plan.append((arg, i))
+            arg = None
+
+        elif not i.startswith('-'):
+            i = i.removeprefix('\\')
+            current_kw += i+' '
+
+        else:
+            if current_kw != '':
+                kw.append(current_kw[:-1])
+
+            current_kw = ''
+            arg = i[1:]
+
+    if current_kw != '':
+        kw.append(current_kw[:-1])
+
+    # keywords
+    plan.extend(('kw', i) for i in kw)
+
+    return plan
+
+
  
 # user and user-related classes
 
@@ -188,92 +321,165 @@ class User:
         self.saved: Dict[int, Message] = {
             int(k): Message(int(k), v) for k,v in data.get('saved', {}).items()
         }
+        self.index: "SearchIndex | None" = None
+        self.orders: Orders = Orders(self.saved)
+        self.completions: "Completions | None" = None
+        self.version: int = 0
+        self.dirty: bool = True # changed since the last commit
+
+
+    def get_index(self) -> SearchIndex:
+        '''
+        Returns the search index of the user.
+
+        The index is built on first use and kept up to date by the manager.
+        '''
+        if self.index == None:
+            self.index = SearchIndex(self.saved, self.orders)
+
+        return self.index
+
+
+    def get_completions(self) -> Completions:
+        '''
+        Returns the autocomplete index of the user.
+
+        The index is built on first use and kept up to date by the manager.
+        '''
+        if self.completions == None:
+            self.completions = Completions(self.saved)
+
+        return self.completions
+
+
+    def indexes(self) -> "List[SearchIndex | Orders | Completions]":
+        '''
+        Returns the built indexes, which the manager keeps up to date.
+        '''
+        return [i for i in [self.index, self.orders, self.completions] if i != None]
 
     
+    def complete(self, current:str, limit:int=25) -> "List[Message]":
+        '''
+        Returns the user's saved messages that match
+        a partially typed ID, note word or tag.
+        '''
+        return self.get_completions().complete(current, limit)
+
+
     def to_dict(self) -> dict:
         '''
         Converts the class to a dictionary to store in the file.
         '''
         return {
-            "saved": {k: v.to_dict() for k,v in self.saved.items()}
+            "saved": {str(k): v.to_dict() for k,v in self.saved.items()}
         }
     
 
-    def search(self, prompt:str, case_sensitive:bool) -> "List[Message]":
+    def search(
+        self, prompt:str, case_sensitive:bool, sort:"str | None"=None
+    ) -> "List[Message]":
         '''
         Searches the user's saved messages for the given prompt.
+
+        Results are newest saved first, or in the given sort.
         '''
-        if prompt == '': return [i for i in self.saved.values()][::-1]
+        ids = self.match(prompt, case_sensitive)
 
-        codes = prompt.split(' ')
-        results: List[List[int]] = []
-        merged: Set[int] = set()
+        if sort != None:
+            return self.order(ids, sort, 0, len(self.saved))
 
-        kw: List[str] = []
-        current_kw: str = ''
-        arg = None
+        if ids == None:
+            return [i for i in self.saved.values()][::-1]
 
-        for i in codes:
-            if arg != None:
-                ids = handle_arg(arg, i, self.saved.values(), case_sensitive)
-                results.append(ids)
+        return [self.saved[i] for i in reversed(self.saved) if i in ids]
 
-                for j in ids:
-                    merged.add(j)
 
-                arg = None
+    def order(
+        self, ids:"Set[int] | None", sort:str, start:int, count:int
+    ) -> "List[Message]":
+        '''
+        Returns a page of sorted search results.
 
-            elif i[0] != '-':
-                i = i.removeprefix('\\')
-                current_kw += i+' '
-                continue
+        `ids` are the matching IDs, None if every message matches.
+        '''
+        if ids != None and not ids:
+            return []
+
+        return self.orders.order(sort, ids, start, count)
 
-            else:
-                if current_kw != '':
-                    kw.append(current_kw[:-1])
 
-                current_kw = ''
-                arg = i[1:]
+    def match(
+        self, prompt:str, case_sensitive:bool, budget:"SearchBudget | None"=None
+    ) -> "Set[int] | None":
+        '''
+        Returns IDs of the user's saved messages that match the prompt,
+        None if the prompt is empty and all of them match.
 
-        if current_kw != '':
-            kw.append(current_kw[:-1])
+        With a budget, raises SearchCancelled once it runs out.
+        '''
+        if prompt == '':
+            return None
 
-        # keywords
-        for i in kw:
-            ids = handle_arg('kw', i, self.saved.values(), case_sensitive)
-            results.append(ids)
+        plan = parse_prompt(prompt)
+        if not plan:
+            return set()
 
-            for j in ids:
-                merged.add(j)
+        index = self.get_index()
 
-        # and-ing
-        merged = list(merged)
-        out = []
+        # indexed filters
+        sets: List[Set[int]] = []
+        for arg, value in plan:
+            if arg.lower() not in INDEXED_ARGS:
+                continue
+            if budget != None:
+                budget.check()
 
-        for i in merged:
-            for l in results:
-                if i not in l:
-                    break
-            else:
-                out.append(i)
+            sets.append(set(handle_arg(arg, value, self.saved.values(), case_sensitive, index)))
 
-        # getting messages
-        out = [self.saved[i] for i in out][::-1]
+        out: "Set[int] | None" = intersect(sets) if sets else None
 
-        return out
+        # other filters only check what is left
+        for arg, value in plan:
+            if arg.lower() in INDEXED_ARGS:
+                continue
+            if out != None and not out:
+                break
+            if budget != None:
+                budget.check()
+
+            messages = self.saved.values() if out == None\
+                else [self.saved[i] for i in out]
+            ids = set(handle_arg(arg, value, messages, case_sensitive))
+            out = ids if out == None else out & ids
+
+        return out if out != None else set()
 
 
 # message and message-related classes
 
+def fold(string:str) -> str:
+    '''
+    Casefolds a string, returning the same string if it does not change,
+    so already casefolded strings are not stored twice.
+    '''
+    folded = string.casefold()
+    return string if folded == string else folded
+
+
 class Attachment:
+    __slots__ = ('parent', 'id', 'type', 'extension', 'filename', 'url')
+
     def __init__(self, id:int, data:dict):
         '''
         Represents a message attachment.
+
+        Types and extensions repeat a lot, so they are interned.
         '''
         self.parent: int = id
         self.id: int = data['id']
-        self.type: str = data.get('type', 'none')
-        self.extension: str = data.get('extension', 'none')
+        self.type: str = sys.intern(data.get('type', 'none'))
+        self.extension: str = sys.intern(data.get('extension', 'none'))
         self.filename: str = data['filename']
         self.url: str = data['url']
 
@@ -307,9 +513,21 @@ class Attachment:
         }
 
 class Message:
+    __slots__ = (
+        'id', 'link', 'guild_id', 'channel_id', 'text', 'note', 'saved_at',
+        'tags', 'attachments', 'sent_at', 'author_name', 'author_id',
+        'version', 'folded_author', '_folded_text', '_folded_note'
+    )
+
     def __init__(self, id:int, data:dict):
         '''
         Represents a saved message.
+
+        Tags and author names repeat a lot, so they are interned.
+        `version` changes every time the bookmark is edited. Casefolded
+        copies of the text and note for case-insensitive searching are
+        made on first use, the author name is interned so it is made
+        right away.
         '''
         self.id: int = id
         self.link: str = data['link']
@@ -322,15 +540,53 @@ class Message:
         if len(self.note) == 0:
             self.note = '...'
         self.saved_at: float = data.get('saved_at', time.time())
-        self.tags: List[str] = data.get('tags', [])
-        self.attachments: List[Attachment] = [
+        self.tags: List[str] = [sys.intern(i) for i in data.get('tags', [])]
+        self.attachments: Tuple[Attachment, ...] = tuple(
             Attachment(self.id, i) for i in data.get('attachments', [])
-        ]
+        )
         self.sent_at: float = data['sent_at']
-        self.author_name: str = data['author']
+        self.author_name: str = sys.intern(data['author'])
+        self.folded_author: str = sys.intern(fold(self.author_name))
         self.author_id: int = data['author_id']
-        self.author_url: str = f'https://discord.com/users/{self.author_id}'
+        self.version: int = next(VERSIONS)
+        self._folded_text: "str | None" = None
+        self._folded_note: "str | None" = None
 
+
+    @property
+    def folded_text(self) -> str:
+        '''
+        Casefolded text.
+        '''
+        if self._folded_text == None:
+            self._folded_text = fold(self.text)
+        return self._folded_text
+
+
+    @property
+    def folded_note(self) -> str:
+        '''
+        Casefolded note.
+        '''
+        if self._folded_note == None:
+            self._folded_note = fold(self.note)
+        return self._folded_note
+
+
+    def set_note(self, note:str):
+        '''
+        Changes the note.
+        '''
+        self.note = note
+        self._folded_note = None
+
+
+    @property
+    def author_url(self) -> str:
+        '''
+        Link to the author's profile.
+        '''
+        return f'https://discord.com/users/{self.author_id}'
     
     def to_dict(self) -> dict:
         '''
@@ -342,7 +598,7 @@ class Message:
             "note": self.note,
             "saved_at": self.saved_at,
             "sent_at": self.sent_at,
-            "tags": self.tags,
+            "tags": list(self.tags),
             "guild_id": self.guild_id,
             "channel_id": self.channel_id,
             "attachments": [i.to_dict() for i in self.attachments],
@@ -351,14 +607,152 @@ class Message:
         }
 
 
+# importing
+
+def check_bookmark(data:Any) -> "Tuple[int, dict] | None":
+    '''
+    Validates an imported bookmark in the format `Manager.export` writes.
+
+    Returns the message ID and a dict to pass in the Message object,
+    or None if the bookmark is malformed.
+    '''
+    def number(value:Any) -> bool:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    def integer(value:Any) -> bool:
+        return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+    if not isinstance(data, dict):
+        return None
+
+    if not integer(data.get('id', None)) or not integer(data.get('channel_id', None))\
+        or not integer(data.get('author_id', None)):
+            return None
+
+    if not isinstance(data.get('link', None), str) or not isinstance(data.get('author', None), str)\
+        or not number(data.get('sent_at', None)):
+            return None
+
+    guild_id = data.get('guild_id', None)
+    if guild_id != None and not integer(guild_id):
+        return None
+
+    text = data.get('text', '')
+    note = data.get('note', None)
+    saved_at = data.get('saved_at', time.time())
+    tags = data.get('tags', [])
+    attachments = data.get('attachments', [])
+
+    # notes are exported already escaped, every escaped character
+    # takes two, so they can be up to twice as long as NOTE_LEN
+    if not isinstance(text, str) or not number(saved_at)\
+        or (note != None and (not isinstance(note, str) or len(note) > NOTE_LEN*2))\
+        or not isinstance(tags, list) or not isinstance(attachments, list):
+            return None
+
+    # tags are normalized like in add_tag
+    out_tags = []
+    for i in tags:
+        if not isinstance(i, str):
+            return None
+
+        i = i.lower().replace(' ','_')[:TAG_LEN]
+        if i and i not in out_tags:
+            out_tags.append(i)
+
+    for i in attachments:
+        if not isinstance(i, dict) or not integer(i.get('id', None)) or not all(
+            isinstance(i.get(key, None), str) for key in ['type', 'extension', 'filename', 'url']
+        ):
+            return None
+
+    out = {
+        "link": data['link'],
+        "text": text,
+        "saved_at": saved_at,
+        "sent_at": data['sent_at'],
+        "tags": out_tags[:MAX_TAGS],
+        "guild_id": guild_id,
+        "channel_id": data['channel_id'],
+        "attachments": [{
+            "id": i['id'],
+            "type": i['type'],
+            "extension": i['extension'],
+            "filename": i['filename'],
+            "url": i['url']
+        } for i in attachments],
+        "author": data['author'],
+        "author_id": data['author_id']
+    }
+    if note != None:
+        out['note'] = note
+
+    return data['id'], out
+
+
+def parse_bookmarks(lines:Iterable["str | bytes"]) -> Tuple[List["Message"], int]:
+    '''
+    Parses JSON lines in the format `Manager.export` writes into messages.
+
+    Does not touch any user data, so it can run outside of the event loop.
+    Returns the messages and the number of malformed lines.
+    '''
+    messages: List[Message] = []
+    skipped = 0
+
+    for line in lines:
+        if not line.strip():
+            continue
+
+        try:
+            bookmark = check_bookmark(json.loads(line))
+        except ValueError:
+            bookmark = None
+
+        if bookmark == None:
+            skipped += 1
+            continue
+
+        messages.append(Message(*bookmark))
+
+    return messages, skipped
+
+
 # manager
 
 class Manager:
-    def __init__(self, users_file:str):
+    def __init__(self, storage:Storage):
         '''
         API and backend manager.
+
+        All data lives in memory, every mutation is passed on to the storage
+        through a writer, so it can be written outside of the event loop.
+
+        Concurrency: user data is only changed from the event loop and no
+        method awaits, so every call is atomic for other coroutines. Code
+        that awaits between reading and changing a user's data, or reads it
+        from another thread, holds that user's lock from `lock`. Every user
+        has their own lock, so users never wait for each other. The writer
+        is the only thing that touches the storage, and it only gets copies
+        of the data, never live objects.
+
+        Searches, sorts and index builds of large libraries run in a thread
+        pool with `match_async` and `complete_async`, and imports are parsed
+        and serialized in a thread with `import_async`. These are the only methods
+        that await. `complete_async` takes the user's lock itself, callers of
+        the others hold it until the thread is done.
         '''
-        self.users_file: str = users_file
+        self.storage: Storage = storage
+        self.writer: Writer = Writer(storage)
+        self.search_cache: LRUCache = LRUCache(SEARCH_CACHE_SIZE)
+        self.locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+        self.search_pool = concurrent.futures.ThreadPoolExecutor(
+            SEARCH_THREADS, thread_name_prefix='search'
+        )
+        self.search_lock: threading.Lock = threading.Lock()
+        self.searches_queued: int = 0 # submitted and waiting for a thread
+        self.searches_running: int = 0
 
         self.reload()
 
@@ -377,11 +771,10 @@ class Manager:
         Creates a duplicate of the database and creates a new one.
         '''
         log('Panic!', 'api', WARNING)
+        self.lazy = False
 
         # copying file
-        if os.path.exists(self.users_file):
-            os.rename(self.users_file, self.users_file+'.bak')
-            log(f'Cloned user data file to {self.users_file}.bak', 'api')
+        self.storage.panic()
 
         # creating a new one
         self.new()
@@ -390,46 +783,114 @@ class Manager:
     def reload(self):
         '''
         Reloads user data and bot data.
+
+        With lazy loading, users are only read from the storage
+        once they are needed. Otherwise they are streamed, so only
+        one user's data is in memory as dicts at a time.
         '''
-        # user data
-        try:
-            with open(self.users_file, encoding='utf-8') as f:
-                data = json.load(f)
-        except:
-            self.panic()
+        # lazy loading
+        self.lazy: bool = LAZY_LOAD and self.storage.load_index()
+
+        if self.lazy:
+            self.users: Dict[int, User] = {}
             return
 
-        self.users = {int(id): User(int(id), data) for id, data in data['users'].items()}
+        # user data, converting users to objects as they are read
+        self.users: Dict[int, User] = {}
 
-        # saving
-        self.commit()
+        try:
+            for id, data in self.storage.iter_users():
+                self.users[id] = User(id, data)
+
+        except Exception as e:
+            log(f'Unable to read user data: {e}', 'api', WARNING)
+
+            # recovering from backups
+            try:
+                data = self.storage.load()
+            except:
+                self.panic()
+                return
 
+            self.users = {id: User(id, data) for id, data in data.items()}
 
-    def commit(self):
+        for id, user in self.users.items():
+            user.dirty = not self.storage.stored(id)
+
+
+    def write(self, op:str, user:int, message:int, data:Any=None):
         '''
-        Saves user data to the file.
+        Records a mutation of user data.
+
+        Bumps the user's version, so everything cached for them is outdated,
+        and passes the mutation to the storage. Saves a full snapshot if the
+        storage asks for one. Users are only saved again on the next commit
+        if the storage does not store mutations for good.
         '''
-        data = {
-            'users': {}
-        }
+        guser = self.get_user(user)
+        guser.version += 1
+        if not self.storage.durable_writes():
+            guser.dirty = True
+        self.writer.write(op, user, message, data)
+
+        if self.writer.wants_snapshot:
+            self.commit()
+
+
+    @metrics.timed('api.commit')
+    def commit(self, serialized:List[Tuple[int, dict]]=[]):
+        '''
+        Saves user data to the storage.
+
+        Only users that changed since the last commit are serialized,
+        the storage keeps its copy of everyone else. Users that are
+        already serialized can be passed in `serialized`.
+        '''
+        snapshot = list(serialized)
+
+        for i, user in self.users.items():
+            if user.dirty:
+                snapshot.append((i, user.to_dict()))
+                user.dirty = False
+
+        self.writer.save(snapshot)
+
+
+    def close(self):
+        '''
+        Writes all pending changes and closes the storage.
+        '''
+        self.search_pool.shutdown(cancel_futures=True)
+        self.writer.close()
+
+
+    def lock(self, user:int) -> asyncio.Lock:
+        '''
+        Returns the lock of a user.
+
+        Locks are dropped once nothing holds or waits for them.
+        '''
+        lock = self.locks.get(user, None)
 
-        # users
-        for i in self.users:
-            data['users'][i] = self.users[i].to_dict()
+        if lock == None:
+            lock = asyncio.Lock()
+            self.locks[user] = lock
 
-        # saving
-        with open(self.users_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False)
+        return lock
 
 
     def check_user(self, id:int):
         '''
         Checks if user exists in database. If not, creates one.
+
+        Loads the user from the storage if they are not loaded yet.
         '''
         if id in self.users:
             return
-        
-        self.users[id] = User(id)
+
+        data = self.storage.load_user(id) if self.lazy else None
+        self.users[id] = User(id, data or {})
+        self.users[id].dirty = not self.storage.stored(id)
 
 
     def get_user(self, id:int) -> User:
@@ -442,6 +903,218 @@ class Manager:
         return self.users[id]
 
 
+    @metrics.timed('api.match')
+    def match(self, user:int, prompt:str, case_sensitive:bool) -> "FrozenSet[int] | None":
+        '''
+        Returns IDs of the user's saved messages that match the prompt,
+        None if all of them do.
+
+        Results are cached until the user's bookmarks change.
+        '''
+        guser = self.get_user(user)
+        if prompt == '':
+            return None
+
+        key = self.match_key(user, prompt, case_sensitive)
+        cached = self.cached_match(key, guser)
+
+        if cached != None:
+            return cached
+
+        out = frozenset(guser.match(prompt, case_sensitive))
+        self.cache_match(key, guser, out)
+
+        return out
+
+
+    @metrics.timed('api.match_async')
+    async def match_async(
+        self, user:int, prompt:str, case_sensitive:bool, sort:str='saved'
+    ) -> "FrozenSet[int] | None":
+        '''
+        Same as `match`, but also prepares pages in the given sort.
+        Searches of libraries with at least SEARCH_OFFLOAD_SIZE bookmarks,
+        and building the index and sorting libraries with at least
+        INDEX_OFFLOAD_SIZE bookmarks, run in the search threads.
+
+        Raises SearchCancelled if the search takes longer than SEARCH_TIMEOUT.
+        The user's data is read from another thread, so the caller has
+        to hold the user's lock.
+        '''
+        if not self.offloads(user, prompt, sort):
+            return self.match(user, prompt, case_sensitive)
+
+        guser = self.get_user(user)
+        key = self.match_key(user, prompt, case_sensitive) if prompt != '' else None
+        cached = self.cached_match(key, guser)
+
+        if cached != None and guser.orders.ready(sort, False):
+            return cached
+
+        budget = SearchBudget(SEARCH_TIMEOUT)
+
+        def run() -> "FrozenSet[int] | None":
+            guser.orders.prepare(sort, prompt == '')
+
+            if prompt == '' or cached != None:
+                return cached
+
+            # building the index and sorting do not count towards the search time
+            guser.get_index()
+            budget.restart()
+            return frozenset(guser.match(prompt, case_sensitive, budget))
+
+        try:
+            out = await self.offload(run, budget)
+
+        except SearchCancelled:
+            log(f'Search of {len(guser.saved)} bookmarks for {user} ran out of time', 'api', WARNING)
+            raise
+
+        if cached == None:
+            self.cache_match(key, guser, out)
+        return out
+
+
+    async def offload(self, func:Callable[[], Any], budget:"SearchBudget | None"=None) -> Any:
+        '''
+        Runs a function in the search threads and returns its result.
+
+        If the caller is cancelled, the budget is cancelled and the
+        thread is waited for, so it does not outlive the caller's lock.
+        '''
+        submitted = time.perf_counter()
+
+        def run() -> Any:
+            with self.search_lock:
+                self.searches_queued -= 1
+                self.searches_running += 1
+            metrics.record('api.search_queued', (time.perf_counter()-submitted)*1000)
+
+            try:
+                return func()
+            finally:
+                with self.search_lock:
+                    self.searches_running -= 1
+
+        with self.search_lock:
+            self.searches_queued += 1
+
+        future = asyncio.get_running_loop().run_in_executor(self.search_pool, run)
+
+        try:
+            return await asyncio.shield(future)
+
+        except asyncio.CancelledError:
+            if budget != None:
+                budget.cancel()
+            await asyncio.wait([future])
+
+            if not future.cancelled():
+                future.exception()
+            raise
+
+
+    @metrics.timed('api.complete_async')
+    async def complete_async(self, user:int, current:str, limit:int=25) -> List[Message]:
+        '''
+        Returns bookmarks for the manage command autocomplete.
+
+        The autocomplete index of libraries with at least INDEX_OFFLOAD_SIZE
+        bookmarks is built in the search threads. Autocomplete only reads,
+        so the user's lock is taken here and only while building.
+        '''
+        guser = self.get_user(user)
+
+        if guser.completions == None and len(guser.saved) >= INDEX_OFFLOAD_SIZE:
+            async with self.lock(user):
+                if guser.completions == None:
+                    await self.offload(guser.get_completions)
+
+        return guser.complete(current, limit)
+
+
+    def offloads(self, user:int, prompt:str, sort:str='saved') -> bool:
+        '''
+        Returns whether `match_async` runs in the search threads.
+        '''
+        guser = self.get_user(user)
+        size = len(guser.saved)
+
+        if prompt != '' and size >= SEARCH_OFFLOAD_SIZE:
+            return True
+
+        # building the index or sorting
+        return size >= INDEX_OFFLOAD_SIZE and (
+            (prompt != '' and guser.index == None) or not guser.orders.ready(sort, prompt == '')
+        )
+
+
+    def match_key(self, user:int, prompt:str, case_sensitive:bool) -> "Hashable | None":
+        '''
+        Returns the search cache key of a prompt,
+        None if the results can't be cached.
+
+        Values are lowercased like `handle_arg` does first, not casefolded,
+        as tags, servers and attachments are compared lowercased and values
+        that casefold the same can match different bookmarks.
+        '''
+        plan = tuple(
+            (arg.lower(), value if case_sensitive else value.lower())
+            for arg, value in parse_prompt(prompt)
+        )
+
+        # times ago move with the clock
+        if any(arg in DATE_ARGS and utils.relative_time(value) != None for arg, value in plan):
+            return None
+
+        return (user, plan, case_sensitive)
+
+
+    def cached_match(self, key:"Hashable | None", guser:User) -> "FrozenSet[int] | None":
+        '''
+        Returns cached search results if they are still up to date.
+        '''
+        if key == None:
+            return None
+
+        cached = self.search_cache.get(key, guser.version)
+
+        if (self.search_cache.hits+self.search_cache.misses) % CACHE_REPORT_EVERY == 0:
+            stats = self.search_cache.stats()
+            log(f'Search cache: {stats["entries"]} entries, '\
+                f'{stats["hit_rate"]:.0%} hit rate, {stats["bytes"]/1024:.0f} KiB', 'api')
+
+        return cached
+
+
+    def cache_match(self, key:"Hashable | None", guser:User, out:FrozenSet[int]):
+        '''
+        Caches search results until the user's bookmarks change.
+        '''
+        if key == None:
+            return
+
+        self.search_cache.put(
+            key, out, guser.version, sys.getsizeof(out)+sys.getsizeof(key[1])
+        )
+
+
+    @metrics.timed('api.page')
+    def page(
+        self, user:int, ids:"FrozenSet[int] | None", sort:str, start:int, count:int
+    ) -> List[Message]:
+        '''
+        Returns a page of search results from `match` in the given sort,
+        without sorting the results that are not on it. `match_async`
+        prepares the sort, so large libraries are not sorted here.
+
+        Bookmarks removed since searching are left out.
+        '''
+        return self.get_user(user).order(ids, sort, start, count)
+
+
+    @metrics.timed('api.get_bookmark')
     def get_bookmark(self, user:int, message:int) -> "Message | None":
         '''
         Returns a bookmarked message by ID.
@@ -454,6 +1127,7 @@ class Manager:
         return guser.saved[message]
 
 
+    @metrics.timed('api.bookmark')
     def bookmark(self, user:int, message:discord.Message) -> bool:
         '''
         Bookmarks a message.
@@ -478,10 +1152,14 @@ class Manager:
             "author": message.author.name,
             "author_id": message.author.id
         })
-        self.commit()
+        for i in guser.indexes():
+            i.add(guser.saved[message.id])
+
+        self.write('bookmark', user, message.id, guser.saved[message.id].to_dict())
         return True
 
 
+    @metrics.timed('api.set_note')
     def set_note(self, user:int, message:int, note:str) -> bool:
         '''
         Sets a note for a bookmarked message.
@@ -493,11 +1171,19 @@ class Manager:
         if message not in guser.saved:
             return False
 
-        guser.saved[message].note = utils.remove_md(note, True)
-        self.commit()
+        bm: Message = guser.saved[message]
+        old = bm.note
+        bm.set_note(utils.remove_md(note, True))
+        bm.version = next(VERSIONS)
+
+        for i in guser.indexes():
+            i.set_note(bm, old)
+
+        self.write('note', user, message, bm.note)
         return True
 
 
+    @metrics.timed('api.add_tag')
     def add_tag(self, user:int, message:int, tag:str) -> bool:
         '''
         Adds a tag to a bookmark.
@@ -509,18 +1195,22 @@ class Manager:
         if message not in guser.saved:
             return False
         
-        tag = tag.lower().replace(' ','_')
+        tag = sys.intern(tag.lower().replace(' ','_'))
         message: Message = guser.saved[message]
 
         if tag in message.tags:
             return False
         
         message.tags.append(tag)
+        message.version = next(VERSIONS)
+        for i in guser.indexes():
+            i.add_tag(message, tag)
 
-        self.commit()
+        self.write('add_tag', user, message.id, tag)
         return True
 
 
+    @metrics.timed('api.remove_tag')
     def remove_tag(self, user:int, message:int, tag:str) -> bool:
         '''
         Removes a tag from a bookmark.
@@ -539,11 +1229,95 @@ class Manager:
             return False
         
         message.tags.remove(tag)
+        message.version = next(VERSIONS)
+        for i in guser.indexes():
+            i.remove_tag(message, tag)
 
-        self.commit()
+        self.write('remove_tag', user, message.id, tag)
         return True
 
 
+    def export(self, user:int) -> Iterator[bytes]:
+        '''
+        Yields the user's bookmarks as JSON lines, oldest saved first.
+
+        Lines are encoded one at a time, so the export never
+        has to be in memory as a whole.
+        '''
+        guser = self.get_user(user)
+
+        for i in list(guser.saved.values()):
+            yield json.dumps({"id": i.id, **i.to_dict()}, ensure_ascii=False).encode()+b'\n'
+
+
+    @metrics.timed('api.import_async')
+    async def import_async(self, user:int, lines:Iterable["str | bytes"]) -> Tuple[int, int]:
+        '''
+        Bookmarks messages from JSON lines in the format `export` writes.
+
+        Malformed lines and already bookmarked messages are skipped. All
+        imported bookmarks are saved with a single commit instead of a
+        storage write per bookmark. Parsing and serializing the user
+        run in a thread.
+
+        The user's data is read from another thread, so the caller has
+        to hold the user's lock.
+
+        Returns the number of imported and skipped lines.
+        '''
+        messages, skipped = await asyncio.to_thread(parse_bookmarks, lines)
+        imported, existing = self.add_bookmarks(user, messages)
+
+        if imported:
+            # changes made while serializing mark the user dirty again
+            guser = self.get_user(user)
+            guser.dirty = False
+            data = await asyncio.to_thread(guser.to_dict)
+            self.commit([] if guser.dirty else [(user, data)])
+
+        log(f'Imported {imported} bookmarks for {user}, skipped {skipped+existing}', 'api')
+        return imported, skipped+existing
+
+
+    @metrics.timed('api.add_bookmarks')
+    def add_bookmarks(self, user:int, messages:List[Message]) -> Tuple[int, int]:
+        '''
+        Bookmarks parsed messages without writing them to the storage,
+        the caller has to save the user.
+
+        Already bookmarked messages and messages past MAX_IMPORT are skipped.
+        Returns the number of added and skipped messages.
+        '''
+        guser = self.get_user(user)
+        imported: List[Message] = []
+
+        for message in messages:
+            if message.id in guser.saved or len(guser.saved) >= MAX_IMPORT:
+                continue
+
+            guser.saved[message.id] = message
+            imported.append(message)
+
+        if not imported:
+            return 0, len(messages)
+
+        # rebuilding is cheaper than adding many messages one by one
+        # and happens in the search threads on next use
+        if len(imported) >= INDEX_OFFLOAD_SIZE:
+            guser.index = guser.completions = None
+            guser.orders = Orders(guser.saved)
+        else:
+            for index in guser.indexes():
+                for i in imported:
+                    index.add(i)
+
+        guser.version += 1
+        guser.dirty = True
+
+        return len(imported), len(messages)-len(imported)
+
+
+    @metrics.timed('api.remove_bookmark')
     def remove_bookmark(self, user:int, message:int) -> bool:
         '''
         Unbookmarks a message.
@@ -555,6 +1329,9 @@ class Manager:
         if message not in guser.saved:
             return False
 
-        guser.saved.pop(message)
-        self.commit()
+        bm: Message = guser.saved.pop(message)
+        for i in guser.indexes():
+            i.remove(bm)
+
+        self.write('remove', user, message)
         return True
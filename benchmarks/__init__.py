@@ -0,0 +1,9 @@
+'''
+Benchmarks for the bot's hot paths.
+
+Run them from the repository root, e.g. `python -m benchmarks.search`.
+`python -m benchmarks.suite --out results.json` runs all timed benchmarks
+and writes the results as JSON, `--compare` compares them with an older run.
+`python -m benchmarks.synthetic` generates a users.json to test with.
+`python -m benchmarks.reload` compares peak memory of loading users.
+'''
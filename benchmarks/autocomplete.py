@@ -0,0 +1,80 @@
+from typing import *
+
+import api
+import index
+import random
+import sys
+import time
+from benchmarks.synthetic import make_user
+
+
+# reference
+
+def brute_force(user:api.User, current:str, limit:int) -> List[int]:
+    '''
+    Same ranking as the autocomplete, computed by scanning every bookmark.
+    '''
+    current = current.strip().casefold()
+    if current == '':
+        return list(reversed(user.saved))[:limit]
+
+    out = sorted((i for i in user.saved if str(i).startswith(current)), reverse=True)
+
+    *full, prefix = current.split()
+    matches = []
+
+    for i, message in user.saved.items():
+        words = index.words(message.note) | set(message.tags)
+        if any(j.startswith(prefix) for j in words) and set(full) <= words:
+            matches.append(i)
+
+    out += [i for i in sorted(matches, reverse=True) if i not in out]
+    return out[:limit]
+
+
+# benchmark
+
+def keystrokes(user:api.User, rng:random.Random) -> List[str]:
+    '''
+    Returns everything a user types while looking for a random bookmark.
+    '''
+    message = rng.choice(list(user.saved.values()))
+    typed = [str(message.id)[:i] for i in range(len(str(message.id))+1)]
+
+    words = message.note.split()[:3]
+    note = ' '.join(words)
+    typed += [note[:i] for i in range(1, len(note)+1)]
+
+    return typed
+
+
+def run(sizes:List[int], limit:int=25):
+    rng = random.Random(0)
+
+    for size in sizes:
+        user = api.User(1, make_user(size))
+        start = time.perf_counter()
+        user.get_completions()
+        build = (time.perf_counter()-start)*1000
+
+        times = []
+
+        for _ in range(20):
+            for current in keystrokes(user, rng):
+                start = time.perf_counter()
+                out = user.complete(current, limit)
+                times.append((time.perf_counter()-start)*1000)
+
+                if len(times) % 10 == 0:
+                    expected = brute_force(user, current, limit)
+                    assert [i.id for i in out] == expected, f'results differ for {current!r}'
+
+        times.sort()
+        print(f'{size:>7} bookmarks  index {build:>8.0f}ms   per keystroke'
+            f' p50 {times[len(times)//2]:.3f}ms  p99 {times[len(times)*99//100]:.3f}ms'
+            f'  max {times[-1]:.3f}ms')
+
+
+## RUNNING
+if __name__ == '__main__':
+    run([int(i) for i in sys.argv[1:]] or [1000, 10000, 50000])
@@ -0,0 +1,74 @@
+from typing import *
+
+import api
+import sys
+import time
+from benchmarks.synthetic import make_user
+
+
+# reference
+
+def lowered(arg:str, value:str, messages:List[api.Message]) -> List[int]:
+    '''
+    Case-insensitive filters as they were before the casefolded copies:
+    every message is lowercased for every query.
+    '''
+    value = value.lower()
+
+    if arg == 'text':
+        return [m.id for m in messages if value in m.text.lower()]
+    if arg == 'note':
+        return [m.id for m in messages if value in m.note.lower()]
+    if arg == 'keyword':
+        return [m.id for m in messages if value in m.text.lower() or value in m.note.lower()]
+    return [m.id for m in messages if m.author_name.lower() == value or str(m.author_id) == value]
+
+
+# benchmark
+
+QUERIES = [
+    ('text', 'cat'),
+    ('text', 'привет'),
+    ('note', 'game'),
+    ('keyword', 'hello'),
+    ('by', 'user3'),
+]
+
+
+def measure(func:Callable, repeat:int=5) -> float:
+    '''
+    Returns the best run time of a function in milliseconds.
+    '''
+    best = float('inf')
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter()-start)
+
+    return best*1000
+
+
+def run(sizes:List[int]):
+    print(f'{"bookmarks":>9} {"query":<18} {"lower()":>10} {"first":>10} {"folded":>10} {"saving":>8}')
+
+    for size in sizes:
+        user = api.User(1, make_user(size))
+        messages = list(user.saved.values())
+
+        for arg, value in QUERIES:
+            old_ms = measure(lambda: lowered(arg, value, messages))
+
+            # the first query makes the casefolded copies
+            for i in messages:
+                i._folded_text = i._folded_note = None
+            first_ms = measure(lambda: api.handle_arg(arg, value, messages, False), 1)
+            new_ms = measure(lambda: api.handle_arg(arg, value, messages, False))
+
+            print(f'{size:>9} {f"-{arg} {value}":<18} {old_ms:>8.2f}ms {first_ms:>8.2f}ms'
+                f' {new_ms:>8.2f}ms {1-new_ms/old_ms:>8.0%}')
+
+
+## RUNNING
+if __name__ == '__main__':
+    run([int(i) for i in sys.argv[1:]] or [1000, 10000, 50000])
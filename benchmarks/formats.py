@@ -0,0 +1,82 @@
+from typing import *
+
+import formats
+import json
+import os
+import storage
+import sys
+import tempfile
+import time
+from benchmarks.synthetic import make_user
+
+
+# round trip
+
+def check(path:str, users:Dict[int, dict], name:str):
+    '''
+    Checks that a snapshot reads back exactly as it was written,
+    both fully and one user at a time.
+    '''
+    expected = json.loads(json.dumps(users))
+
+    loaded = storage.FileStorage(path, name).load()
+    assert json.loads(json.dumps(loaded)) == expected, f'{name}: full load differs'
+
+    lazy = storage.FileStorage(path, name)
+    assert lazy.load_index(), f'{name}: index not usable'
+    for id in users:
+        user = json.loads(json.dumps(lazy.load_user(id)))
+        assert user == expected[str(id)], f'{name}: user {id} differs'
+
+
+def check_conversion(folder:str, users:Dict[int, dict], names:List[str]):
+    '''
+    Checks that a snapshot in one format is detected and rewritten in another.
+    '''
+    for old in names:
+        for new in names:
+            path = os.path.join(folder, f'{old}-{new}')
+            storage.FileStorage(path, old).save(users.items())
+
+            # only some users are passed in, the rest is copied over
+            converted = storage.FileStorage(path, new)
+            converted.load_index()
+            converted.save([(0, users[0])])
+
+            assert formats.detect_format(path).name == new
+            check(path, users, new)
+
+
+# benchmark
+
+def run(users:int, bookmarks:int):
+    data = {i: make_user(bookmarks, i) for i in range(users)}
+    names = ['json', 'marshal'] + (['msgpack'] if formats.msgpack != None else [])
+
+    with tempfile.TemporaryDirectory() as folder:
+        check_conversion(folder, {i: data[i] for i in range(3)}, names)
+
+        for name in names:
+            path = os.path.join(folder, f'users.{name}')
+
+            start = time.perf_counter()
+            storage.FileStorage(path, name).save(data.items())
+            save = time.perf_counter()-start
+
+            start = time.perf_counter()
+            storage.FileStorage(path, name).load()
+            load = time.perf_counter()-start
+
+            check(path, data, name)
+
+            size = os.path.getsize(path)/1024/1024
+            print(f'{name:<8} {size:>8.1f} MiB   save {size/save:>7.1f} MiB/s'
+                f'   load {size/load:>7.1f} MiB/s   ({save*1000:.0f}ms / {load*1000:.0f}ms)')
+
+
+## RUNNING
+if __name__ == '__main__':
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    )
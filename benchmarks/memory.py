@@ -0,0 +1,40 @@
+from typing import *
+
+import api
+import gc
+import json
+import sys
+import tracemalloc
+from benchmarks.synthetic import make_user
+
+
+# benchmark
+
+def measure(bookmarks:int) -> float:
+    '''
+    Returns the memory taken up by a user's bookmarks in bytes per bookmark.
+
+    The user is parsed from JSON like on startup, so every string is
+    a separate object unless the models share them.
+    '''
+    raw = json.dumps(make_user(bookmarks))
+    gc.collect()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    user = api.User(1, json.loads(raw))
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return (after-before)/len(user.saved)
+
+
+def run(sizes:List[int]):
+    for size in sizes:
+        print(f'{size:>7} bookmarks {measure(size):>10.0f} bytes per bookmark')
+
+
+## RUNNING
+if __name__ == '__main__':
+    run([int(i) for i in sys.argv[1:]] or [1000, 10000, 50000])
@@ -0,0 +1,114 @@
+from typing import *
+
+import api
+import asyncio
+import os
+import statistics
+import storage
+import sys
+import tempfile
+import time
+from benchmarks.synthetic import make_users
+
+
+# benchmark
+
+WORDS = ['cat', 'game', 'hello', 'meme', 'world', 'music', 'code', 'news']
+
+
+async def ticker(lags:List[float], stop:asyncio.Event, interval:float=0.001):
+    '''
+    Records how late the loop wakes up, like a gateway heartbeat would.
+    '''
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter()-start-interval)*1000)
+
+
+async def searches(mg:api.Manager, users:List[int], count:int) -> Tuple[int, int]:
+    '''
+    Runs searches for all users at once, returns how many finished and ran out of time.
+    '''
+    async def search(user:int, index:int) -> bool:
+        # different prompts every time so the search cache does not answer them
+        prompt = f'-attachments >=0 {WORDS[index % len(WORDS)]} {WORDS[index//len(WORDS) % len(WORDS)]}'
+
+        async with mg.lock(user):
+            try:
+                await mg.match_async(user, prompt, index % 2 == 0)
+                return True
+            except api.SearchCancelled:
+                return False
+
+    results = await asyncio.gather(*[
+        search(user, index) for index in range(count) for user in users
+    ])
+    return results.count(True), results.count(False)
+
+
+async def measure(mg:api.Manager, users:List[int], count:int) -> dict:
+    lags = []
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+
+    start = time.perf_counter()
+    done, cancelled = await searches(mg, users, count)
+    elapsed = time.perf_counter()-start
+
+    stop.set()
+    await tick
+    mg.search_cache.entries.clear()
+
+    lags.sort()
+    return {
+        "elapsed_ms": elapsed*1000,
+        "done": done,
+        "cancelled": cancelled,
+        "lag_p50_ms": statistics.median(lags) if lags else 0,
+        "lag_p99_ms": lags[int(len(lags)*0.99)] if lags else 0,
+        "lag_max_ms": lags[-1] if lags else 0
+    }
+
+
+def run(users:int, bookmarks:int, count:int):
+    api.LAZY_LOAD = False
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'users.json')
+        storage.FileStorage(path).save(make_users(users, bookmarks))
+        mg = api.Manager(storage.FileStorage(path))
+        ids = list(mg.users)
+
+        # building the indexes once so every mode searches the same way
+        for i in mg.users.values():
+            i.get_index()
+
+        print(f'{users} users, {bookmarks} bookmarks each, {count} searches per user')
+        print(f'{"mode":<12} {"total":>10} {"done":>6} {"timed out":>10}'
+            f' {"lag p50":>10} {"lag p99":>10} {"lag max":>10}')
+
+        modes = [
+            ('inline', 10**12, 60),
+            ('threads', 0, 60),
+            ('budget', 0, 0.005)
+        ]
+
+        for name, size, timeout in modes:
+            api.SEARCH_OFFLOAD_SIZE = size
+            api.SEARCH_TIMEOUT = timeout
+            out = asyncio.run(measure(mg, ids, count))
+
+            print(f'{name:<12} {out["elapsed_ms"]:>8.0f}ms {out["done"]:>6} {out["cancelled"]:>10}'
+                f' {out["lag_p50_ms"]:>8.2f}ms {out["lag_p99_ms"]:>8.2f}ms {out["lag_max_ms"]:>8.2f}ms')
+
+        mg.close()
+
+
+## RUNNING
+if __name__ == '__main__':
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 4,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 50000,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    )
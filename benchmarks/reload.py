@@ -0,0 +1,75 @@
+from typing import *
+
+import api
+import gc
+import os
+import resource
+import storage
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.synthetic import make_users
+
+
+# measuring
+
+def rss() -> int:
+    '''
+    Returns the current resident memory of the process in bytes.
+    '''
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+
+
+def child(path:str, mode:str):
+    '''
+    Loads users in this process and prints the time, peak and steady memory.
+    '''
+    base = rss()
+    start = time.perf_counter()
+
+    if mode == 'full':
+        # everything parsed before converting, how reload used to work
+        data = storage.FileStorage(path).load()
+        users = {id: api.User(id, i) for id, i in data.items()}
+        del data
+    else:
+        if mode == 'stream-noindex':
+            os.remove(path+'.idx')
+        api.LAZY_LOAD = False
+        users = api.Manager(storage.FileStorage(path)).users
+
+    elapsed = (time.perf_counter()-start)*1000
+    gc.collect()
+
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+    print(f'{mode:<16} {len(users):>6} users {elapsed:>9.0f}ms   peak {(peak-base)/1024/1024:>8.1f} MiB'
+        f'   steady {(rss()-base)/1024/1024:>8.1f} MiB')
+
+
+def run(users:int, bookmarks:int):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'users.json')
+        storage.FileStorage(path).save(make_users(users, bookmarks))
+        print(f'{users} users, {bookmarks} bookmarks each, '
+            f'{os.path.getsize(path)/1024/1024:.1f} MiB')
+
+        # every mode in a fresh process, so peaks do not carry over
+        for mode in ['full', 'stream', 'stream-noindex']:
+            subprocess.run(
+                [sys.executable, '-m', 'benchmarks.reload', '--child', path, mode],
+                check=True
+            )
+
+
+## RUNNING
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2], sys.argv[3])
+    else:
+        run(
+            int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+            int(sys.argv[2]) if len(sys.argv) > 2 else 100
+        )
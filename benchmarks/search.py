@@ -0,0 +1,72 @@
+from typing import *
+
+import api
+import sys
+import time
+from benchmarks.synthetic import make_user
+
+
+# reference
+
+def legacy_search(user:api.User, prompt:str, case:bool) -> List[int]:
+    '''
+    The search as it was before the query engine: every filter scans the
+    whole library and the results are and-ed with list lookups.
+    '''
+    results: List[List[int]] = []
+    merged: Set[int] = set()
+
+    for arg, value in api.parse_prompt(prompt):
+        ids = api.handle_arg(arg, value, user.saved.values(), case)
+        results.append(ids)
+        merged.update(ids)
+
+    return [i for i in merged if all(i in l for l in results)]
+
+
+# benchmark
+
+PROMPTS = [
+    'cat',
+    'hello world',
+    '-tag funny cat',
+    '-by user3 -type image',
+    '-guild 1 -channel 7 game',
+    '-attachments >=1 -ext png meme',
+]
+
+
+def measure(func:Callable, repeat:int=5) -> float:
+    '''
+    Returns the best run time of a function in milliseconds.
+    '''
+    best = float('inf')
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter()-start)
+
+    return best*1000
+
+
+def run(sizes:List[int]):
+    for size in sizes:
+        user = api.User(1, make_user(size))
+        user.get_index()
+
+        for prompt in PROMPTS:
+            new = sorted(i.id for i in user.search(prompt, False))
+            old = sorted(legacy_search(user, prompt, False))
+            assert new == old, f'results differ for {prompt!r}'
+
+            new_ms = measure(lambda: user.search(prompt, False))
+            old_ms = measure(lambda: legacy_search(user, prompt, False), 1)
+
+            print(f'{size:>7} {prompt:<32} {old_ms:>10.2f}ms {new_ms:>10.2f}ms'
+                f' {old_ms/max(new_ms, 1e-6):>8.1f}x')
+
+
+## RUNNING
+if __name__ == '__main__':
+    run([int(i) for i in sys.argv[1:]] or [1000, 10000, 50000])
@@ -0,0 +1,60 @@
+from typing import *
+
+import api
+import index
+import random
+import sys
+import time
+from benchmarks.synthetic import make_user
+
+
+# benchmark
+
+def measure(func:Callable, repeat:int=5) -> float:
+    '''
+    Returns the best run time of a function in milliseconds.
+    '''
+    best = float('inf')
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter()-start)
+
+    return best*1000
+
+
+def run(sizes:List[int], page:int=10):
+    rng = random.Random(0)
+    print(f'{"bookmarks":>9} {"sort":<12} {"matching":>9} {"full sort":>11} {"page 1":>10} {"page 50":>10}')
+
+    for size in sizes:
+        user = api.User(1, make_user(size))
+        user.get_index()
+        everything = list(user.saved)
+
+        for sort, (name, descending) in index.SORTS.items():
+            key = index.ORDER_KEYS[name]
+
+            for fraction in [1, 0.2, 0.01]:
+                ids = set(rng.sample(everything, int(size*fraction)))
+
+                # sorting all results and slicing the page out
+                def full(start:int):
+                    messages = [user.saved[i] for i in ids]
+                    messages.sort(key=key, reverse=descending)
+                    return messages[start:start+page]
+
+                assert full(0) == user.order(ids, sort, 0, page), f'results differ for {sort}'
+
+                full_ms = measure(lambda: full(0))
+                first_ms = measure(lambda: user.order(ids, sort, 0, page))
+                later_ms = measure(lambda: user.order(ids, sort, 49*page, page))
+
+                print(f'{size:>9} {sort:<12} {len(ids):>9} {full_ms:>9.2f}ms'
+                    f' {first_ms:>8.2f}ms {later_ms:>8.2f}ms')
+
+
+## RUNNING
+if __name__ == '__main__':
+    run([int(i) for i in sys.argv[1:]] or [10000, 50000])
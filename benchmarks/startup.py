@@ -0,0 +1,58 @@
+from typing import *
+
+import api
+import os
+import storage
+import sys
+import tempfile
+import time
+import tracemalloc
+from benchmarks.synthetic import make_user
+
+
+# benchmark
+
+def start(path:str, lazy:bool) -> Tuple[api.Manager, float, int]:
+    '''
+    Starts a manager and returns it with the startup time in milliseconds
+    and the memory it holds in bytes.
+    '''
+    api.LAZY_LOAD = lazy
+
+    tracemalloc.start()
+    begin = time.perf_counter()
+    mg = api.Manager(storage.FileStorage(path))
+    elapsed = (time.perf_counter()-begin)*1000
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return mg, elapsed, memory
+
+
+def run(users:int, bookmarks:int):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'users.json')
+        storage.FileStorage(path).save(
+            (i, make_user(bookmarks, i)) for i in range(users)
+        )
+        print(f'{users} users, {bookmarks} bookmarks each, '
+            f'{os.path.getsize(path)/1024/1024:.1f} MiB')
+
+        for lazy in [False, True]:
+            mg, elapsed, memory = start(path, lazy)
+
+            begin = time.perf_counter()
+            mg.get_user(users//2)
+            first = (time.perf_counter()-begin)*1000
+            mg.close()
+
+            print(f'{"lazy" if lazy else "eager":<6} startup {elapsed:>9.1f}ms'
+                f' {memory/1024/1024:>8.1f} MiB   first get_user {first:>7.2f}ms')
+
+
+## RUNNING
+if __name__ == '__main__':
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    )
@@ -0,0 +1,245 @@
+from typing import *
+
+import api
+import argparse
+import asyncio
+import contextlib
+import datetime
+import os
+import random
+import storage
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+
+# fake interactions
+
+def fake_message(id:int, author:int) -> SimpleNamespace:
+    '''
+    Returns an object with the fields `Manager.bookmark` reads from a Discord message.
+    '''
+    return SimpleNamespace(
+        id=id,
+        jump_url=f'https://discord.com/channels/1/2/{id}',
+        content=f'message {id} hello world',
+        guild=SimpleNamespace(id=1),
+        channel=SimpleNamespace(id=2),
+        created_at=datetime.datetime.fromtimestamp(1700000000+id, datetime.timezone.utc),
+        attachments=[],
+        author=SimpleNamespace(name=f'user{author}', id=author)
+    )
+
+
+class Model:
+    def __init__(self):
+        '''
+        What every user's bookmarks should look like after the run.
+        '''
+        self.counters: Dict[Tuple[int, int], int] = {}
+        self.toggles: Dict[Tuple[int, int], int] = {}
+        self.churn: Dict[Tuple[int, int], int] = {}
+
+
+class Stress:
+    def __init__(self, mg:api.Manager, users:int, messages:int, lock:bool, seed:int):
+        '''
+        Simulated interactions that read a bookmark, wait like a handler
+        waiting on Discord and then change it.
+        '''
+        self.mg: api.Manager = mg
+        self.users: int = users
+        self.messages: int = messages
+        self.lock: bool = lock
+        self.rng: random.Random = random.Random(seed)
+        self.model: Model = Model()
+        self.searches: int = 0
+        self.imported: int = 0
+        self.failed: List[BaseException] = []
+
+
+    def locked(self, user:int):
+        return self.mg.lock(user) if self.lock else contextlib.nullcontext()
+
+
+    async def count(self, user:int, message:int):
+        # read, modify, write on the note
+        async with self.locked(user):
+            value = int(self.mg.get_bookmark(user, message).note)
+            await asyncio.sleep(0)
+            self.mg.set_note(user, message, str(value+1))
+
+
+    async def toggle(self, user:int, message:int):
+        # adds the tag if it's not there and removes it if it is
+        async with self.locked(user):
+            tags = set(self.mg.get_bookmark(user, message).tags)
+            await asyncio.sleep(0)
+
+            if 'toggled' in tags:
+                self.mg.remove_tag(user, message, 'toggled')
+            else:
+                self.mg.add_tag(user, message, 'toggled')
+
+
+    async def rebookmark(self, user:int, message:int):
+        # removes the bookmark and saves it again with the note and tags kept
+        async with self.locked(user):
+            bm = self.mg.get_bookmark(user, message)
+            self.mg.remove_bookmark(user, message)
+            await asyncio.sleep(0)
+            self.mg.bookmark(user, fake_message(message, user))
+            self.mg.set_note(user, message, bm.note)
+
+            for i in bm.tags:
+                self.mg.add_tag(user, message, i)
+
+
+    async def search(self, user:int):
+        # searching outside of the loop while other tasks keep going
+        async with self.locked(user):
+            guser = self.mg.get_user(user)
+            results = await asyncio.to_thread(guser.search, '-tag toggled', False)
+            self.searches += 1
+
+            for i in results:
+                assert 'toggled' in i.tags, f'search for user {user} returned untagged {i.id}'
+
+
+    def interaction(self) -> Coroutine:
+        '''
+        Picks a random interaction and updates the model with what it should do.
+        '''
+        user = self.rng.randrange(self.users)+1
+        message = self.rng.randrange(self.messages)+1
+        key = (user, message)
+        kind = self.rng.random()
+
+        if kind < 0.4:
+            self.model.counters[key] = self.model.counters.get(key, 0)+1
+            return self.count(user, message)
+        if kind < 0.7:
+            self.model.toggles[key] = self.model.toggles.get(key, 0)+1
+            return self.toggle(user, message)
+        if kind < 0.9:
+            self.model.churn[key] = self.model.churn.get(key, 0)+1
+            return self.rebookmark(user, message)
+        return self.search(user)
+
+
+    async def imports(self):
+        # importing saves only one user while the others have uncommitted
+        # changes that the writer already passed on to the storage
+        await asyncio.to_thread(self.mg.writer.flush)
+        lines = b''.join(self.mg.export(1)).splitlines()
+
+        async with self.locked(self.users+1):
+            self.imported, _ = await self.mg.import_async(self.users+1, lines)
+
+
+    async def run(self, interactions:int, waves:int):
+        for user in range(1, self.users+1):
+            for message in range(1, self.messages+1):
+                self.mg.bookmark(user, fake_message(message, user))
+                self.mg.set_note(user, message, '0')
+        self.mg.commit()
+
+        # every wave is fired at once, with a commit in between,
+        # the last one is only saved with an import
+        for wave in range(waves):
+            results = await asyncio.gather(
+                *[self.interaction() for _ in range(interactions//waves)],
+                return_exceptions=True
+            )
+            self.failed += [i for i in results if isinstance(i, BaseException)]
+
+            if wave < waves-1:
+                self.mg.commit()
+
+        await self.imports()
+
+
+    def check(self, mg:api.Manager) -> List[str]:
+        '''
+        Returns how the users in a manager differ from the model.
+        '''
+        errors = [f'interaction failed: {i!r}' for i in self.failed]
+
+        for user in range(1, self.users+1):
+            guser = mg.get_user(user)
+
+            if len(guser.saved) != self.messages:
+                errors.append(f'user {user}: {len(guser.saved)} bookmarks, expected {self.messages}')
+
+            for message in range(1, self.messages+1):
+                bm = guser.saved.get(message, None)
+                if bm == None:
+                    errors.append(f'user {user}: bookmark {message} lost')
+                    continue
+
+                count = self.model.counters.get((user, message), 0)
+                if bm.note != str(count):
+                    errors.append(f'user {user}: bookmark {message} counted {bm.note}, expected {count}')
+
+                toggled = self.model.toggles.get((user, message), 0) % 2 == 1
+                if ('toggled' in bm.tags) != toggled:
+                    errors.append(f'user {user}: bookmark {message} toggled {not toggled}, expected {toggled}')
+
+            # the index has to agree with the bookmarks after all the changes
+            tagged = {i.id for i in guser.search('-tag toggled', False)}
+            expected = {i.id for i in guser.saved.values() if 'toggled' in i.tags}
+            if tagged != expected:
+                errors.append(f'user {user}: search found {len(tagged)} tagged, expected {len(expected)}')
+
+        imported = len(mg.get_user(self.users+1).saved)
+        if imported != self.imported:
+            errors.append(f'imported user: {imported} bookmarks, expected {self.imported}')
+
+        return errors
+
+
+def run(args:argparse.Namespace) -> int:
+    api.LAZY_LOAD = False
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'users.db' if args.storage == 'sqlite' else 'users.json')
+        storage.get_storage(args.storage, path).save({})
+        mg = api.Manager(storage.get_storage(args.storage, path))
+        stress = Stress(mg, args.users, args.messages, not args.no_lock, args.seed)
+
+        start = time.perf_counter()
+        asyncio.run(stress.run(args.interactions, args.waves))
+        elapsed = time.perf_counter()-start
+        print(f'{args.interactions} interactions for {args.users} users in {elapsed:.2f}s, '
+            f'{stress.searches} searches, {sum(stress.model.churn.values())} rebookmarks')
+
+        errors = stress.check(mg)
+        mg.close()
+
+        # what was written has to match what was in memory
+        reloaded = api.Manager(storage.get_storage(args.storage, path))
+        stress.failed = []
+        errors += [f'after reload: {i}' for i in stress.check(reloaded)]
+        reloaded.close()
+
+    for i in errors[:20]:
+        print(i)
+    if len(errors) > 20:
+        print(f'... and {len(errors)-20} more')
+
+    print(f'{len(errors)} errors' if errors else 'final state matches')
+    return 1 if errors else 0
+
+
+## RUNNING
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fires concurrent interactions at a manager and checks the final state.')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=20, help='bookmarks per user')
+    parser.add_argument('--interactions', type=int, default=20000)
+    parser.add_argument('--waves', type=int, default=4, help='commits during the run')
+    parser.add_argument('--storage', default='file', choices=['file', 'sqlite'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-lock', action='store_true', help='skip the user locks to see lost updates')
+    sys.exit(run(parser.parse_args()))
@@ -0,0 +1,225 @@
+from typing import *
+
+import api
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import storage
+import subprocess
+import sys
+import tempfile
+import time
+import utils
+from benchmarks.autocomplete import keystrokes
+from benchmarks.search import PROMPTS
+from benchmarks.synthetic import Profile, make_users
+
+
+# timing
+
+def measure(func:Callable, repeat:int) -> dict:
+    '''
+    Runs a function a number of times and returns its timings in milliseconds.
+    '''
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter()-start)*1000)
+
+    return {
+        "runs": repeat,
+        "best_ms": min(times),
+        "median_ms": statistics.median(times),
+        "mean_ms": statistics.fmean(times)
+    }
+
+
+def commit_hash() -> "str | None":
+    '''
+    Returns the current git commit, if there is one.
+    '''
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# benchmarks
+
+FILTERS = [
+    ('keyword', 'cat'),
+    ('text', 'hello world'),
+    ('note', 'game'),
+    ('tag', 'funny'),
+    ('server', '1'),
+    ('channel', '7'),
+    ('attachments', '>=2'),
+    ('type', 'image'),
+    ('extension', 'png'),
+    ('by', 'user3'),
+]
+
+
+def bench_reload(path:str, repeat:int) -> Dict[str, dict]:
+    out = {}
+
+    for lazy in [False, True]:
+        api.LAZY_LOAD = lazy
+        mg = api.Manager(storage.FileStorage(path))
+        out[f'reload/{"lazy" if lazy else "eager"}'] = measure(mg.reload, repeat)
+        mg.close()
+
+    return out
+
+
+def bench_commit(path:str, repeat:int) -> Dict[str, dict]:
+    api.LAZY_LOAD = False
+    mg = api.Manager(storage.FileStorage(path))
+    mg.writer.close()
+    mg.writer = storage.Writer(mg.storage, 'immediate')
+    out = {}
+
+    def commit(users:List[api.User]):
+        for i in users:
+            i.dirty = True
+        mg.commit()
+
+    users = list(mg.users.values())
+    out['commit/one_user'] = measure(lambda: commit(users[:1]), repeat)
+    out['commit/all_users'] = measure(lambda: commit(users), repeat)
+
+    mg.close()
+    return out
+
+
+def bench_user(user:api.User, repeat:int) -> Dict[str, dict]:
+    out = {}
+    messages = list(user.saved.values())
+    index = user.get_index()
+    user.get_completions()
+
+    # filters
+    for arg, value in FILTERS:
+        out[f'handle_arg/{arg}/scan'] = measure(
+            lambda: api.handle_arg(arg, value, messages, False), repeat
+        )
+        out[f'handle_arg/{arg}/indexed'] = measure(
+            lambda: api.handle_arg(arg, value, messages, False, index), repeat
+        )
+
+    # search
+    for prompt in PROMPTS:
+        out[f'search/{prompt}'] = measure(
+            lambda: user.search(prompt, False), repeat
+        )
+
+    # autocomplete, formatted like in the manage command
+    typed = keystrokes(user, random.Random(0))
+
+    def complete():
+        for current in typed:
+            [
+                (f'{utils.shorten_string(i.note,50)} ({i.id})', str(i.id))
+                for i in user.complete(current, 25)
+            ]
+
+    out['manage_autocomplete/per_keystroke'] = {
+        k: v/len(typed) if k.endswith('_ms') else v
+        for k, v in measure(complete, repeat).items()
+    }
+
+    return out
+
+
+def run(args:argparse.Namespace) -> dict:
+    results = {}
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = args.file
+
+        if path == None:
+            path = os.path.join(folder, 'users.json')
+            storage.FileStorage(path).save(make_users(
+                args.users, args.bookmarks, args.spread, args.seed,
+                Profile(author_skew=args.author_skew)
+            ))
+
+        results.update(bench_reload(path, args.repeat))
+        results.update(bench_commit(path, args.repeat))
+
+        # the user with the most bookmarks
+        data = storage.FileStorage(path).load()
+        id = max(data, key=lambda i: len(data[i].get('saved', {})))
+        user = api.User(id, data[id])
+        del data
+
+        results.update(bench_user(user, args.repeat))
+
+    return {
+        "meta": {
+            "commit": commit_hash(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.time(),
+            "file": args.file,
+            "users": args.users,
+            "bookmarks": args.bookmarks,
+            "largest_user": len(user.saved),
+            "spread": args.spread,
+            "seed": args.seed
+        },
+        "results": results
+    }
+
+
+def compare(old:dict, new:dict):
+    '''
+    Prints the median times of two runs side by side.
+    '''
+    print(f'{"benchmark":<48} {old["meta"]["commit"] or "old":>12} '
+        f'{new["meta"]["commit"] or "new":>12} {"change":>8}', file=sys.stderr)
+
+    for name, result in new['results'].items():
+        if name not in old['results']:
+            continue
+
+        before = old['results'][name]['median_ms']
+        after = result['median_ms']
+        print(f'{name:<48} {before:>10.3f}ms {after:>10.3f}ms'
+            f' {(after-before)/max(before, 1e-9):>+8.0%}', file=sys.stderr)
+
+
+## RUNNING
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times the hot paths and prints the results as JSON.')
+    parser.add_argument('--file', help='existing users.json to use instead of a generated one')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--bookmarks', type=int, default=500, help='bookmarks per user')
+    parser.add_argument('--spread', action='store_true', help='vary bookmarks per user around the average')
+    parser.add_argument('--author-skew', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--out', help='file to write the results to instead of stdout')
+    parser.add_argument('--compare', help='previous results to compare with')
+    args = parser.parse_args()
+
+    results = run(args)
+    data = json.dumps(results, indent=2)
+
+    if args.out != None:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(data+'\n')
+    else:
+        print(data)
+
+    if args.compare != None:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), results)
@@ -0,0 +1,149 @@
+from typing import *
+
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sys
+
+
+# generating
+
+WORDS = [
+    'hello', 'world', 'bookmark', 'meme', 'cat', 'dog', 'game', 'update', 'patch',
+    'release', 'bug', 'fix', 'server', 'music', 'art', 'drawing', 'anime', 'news',
+    'link', 'video', 'stream', 'python', 'discord', 'bot', 'привет', 'straße', 'café',
+    '日本語', 'emoji', '🎉', 'lol', 'gg', 'wow', 'nice', 'idea', 'todo', 'later'
+]
+TAGS = ['funny', 'important', 'read_later', 'art', 'music', 'code', 'guide', 'lore']
+AUTHORS = [f'user{i}' for i in range(200)]
+TYPES = [('image', 'png'), ('image', 'jpg'), ('image', 'gif'), ('video', 'mp4'),
+         ('audio', 'mp3'), ('text', 'txt'), ('application', 'zip')]
+
+
+class Profile:
+    def __init__(
+        self,
+        text_len:Tuple[int, int]=(0, 40),
+        tag_counts:List[int]=[0, 0, 1, 1, 2, 3],
+        attachment_counts:List[int]=[0, 0, 0, 1, 1, 2, 4],
+        author_skew:float=0
+    ):
+        '''
+        Shape of the generated bookmarks.
+
+        Counts are picked uniformly from the lists, so repeating a number
+        makes it more likely. With `author_skew` above 0, authors are picked
+        following Zipf's law, so a few authors get most of the bookmarks.
+        '''
+        self.text_len: Tuple[int, int] = text_len
+        self.tag_counts: List[int] = tag_counts
+        self.attachment_counts: List[int] = attachment_counts
+        self.author_skew: float = author_skew
+        self.author_weights: List[float] = list(itertools.accumulate(
+            1/(i+1)**author_skew for i in range(len(AUTHORS))
+        ))
+
+
+    def author(self, rng:random.Random) -> int:
+        '''
+        Picks an author.
+        '''
+        if self.author_skew == 0:
+            return rng.randrange(len(AUTHORS))
+
+        return bisect.bisect(self.author_weights, rng.random()*self.author_weights[-1])
+
+
+DEFAULT = Profile()
+
+
+def make_message(rng:random.Random, index:int, profile:Profile=DEFAULT) -> dict:
+    '''
+    Generates a saved message dict in the format `Message.to_dict` returns.
+    '''
+    author = profile.author(rng)
+    text = ' '.join(rng.choices(WORDS, k=rng.randint(*profile.text_len)))
+    attachments = []
+
+    for i in range(rng.choice(profile.attachment_counts)):
+        type, extension = rng.choice(TYPES)
+        attachments.append({
+            "id": rng.getrandbits(60),
+            "type": type,
+            "extension": extension,
+            "filename": f'file{i}.{extension}',
+            "url": f'https://cdn.discordapp.com/attachments/{index}/{i}.{extension}'
+        })
+
+    return {
+        "link": f'https://discord.com/channels/1/2/{index}',
+        "text": text,
+        "note": text[:100] or '...',
+        "saved_at": 1.7e9 + index*60,
+        "sent_at": 1.6e9 + rng.random()*1e8,
+        "tags": rng.sample(TAGS, k=rng.choice(profile.tag_counts)),
+        "guild_id": rng.choice([None, 1, 2, 3, 4, 5]),
+        "channel_id": rng.randrange(50),
+        "attachments": attachments,
+        "author": AUTHORS[author],
+        "author_id": 10**17 + author
+    }
+
+
+def make_user(bookmarks:int, seed:int=0, profile:Profile=DEFAULT) -> dict:
+    '''
+    Generates a user dict in the format `User.to_dict` returns.
+    '''
+    rng = random.Random(seed)
+    base = 10**18 + seed*10**9
+
+    return {
+        "saved": {
+            str(base+i): make_message(rng, base+i, profile) for i in range(bookmarks)
+        }
+    }
+
+
+def make_users(
+    users:int, bookmarks:int, spread:bool=False,
+    seed:int=0, profile:Profile=DEFAULT
+) -> Iterator[Tuple[int, dict]]:
+    '''
+    Generates users one by one.
+
+    `bookmarks` is the number of bookmarks per user. With `spread` it is only
+    the average, most users get a few bookmarks and a few users get a lot.
+    '''
+    rng = random.Random(seed)
+
+    for i in range(users):
+        count = min(int(rng.expovariate(1/bookmarks)), bookmarks*20)\
+            if spread else bookmarks
+        yield (i, make_user(count, seed*users+i, profile))
+
+
+## RUNNING
+if __name__ == '__main__':
+    import storage
+
+    parser = argparse.ArgumentParser(description='Generates a synthetic users.json.')
+    parser.add_argument('path', nargs='?', default='users.json')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--bookmarks', type=int, default=100, help='bookmarks per user')
+    parser.add_argument('--spread', action='store_true', help='vary bookmarks per user around the average')
+    parser.add_argument('--author-skew', type=float, default=0, help='Zipf exponent of authors')
+    parser.add_argument('--format', default='json', help='snapshot format')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        sys.exit(f'{args.path} already exists')
+
+    storage.FileStorage(args.path, args.format).save(make_users(
+        args.users, args.bookmarks, args.spread, args.seed,
+        Profile(author_skew=args.author_skew)
+    ))
+    print(f'Wrote {args.users} users to {args.path}, '
+        f'{os.path.getsize(args.path)/1024/1024:.1f} MiB')
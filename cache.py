@@ -0,0 +1,141 @@
+from typing import *
+
+from collections import OrderedDict
+import sys
+import time
+
+
+# caches
+
+class LRUCache:
+    def __init__(self, max_size:int):
+        '''
+        A cache that drops the least recently used entries once it is full.
+
+        Entries can be stored with a version, looking them up with another
+        version drops them. Keeps track of its hit rate and an estimate
+        of its memory use.
+        '''
+        self.max_size: int = max_size
+        self.entries: "OrderedDict[Hashable, Tuple[Any, int, Any]]" = OrderedDict()
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+
+    def get(self, key:Hashable, version:Any=None) -> Any:
+        '''
+        Returns the cached value or None if there is no up-to-date one.
+        '''
+        entry = self.entries.get(key, None)
+
+        if entry != None and entry[2] != version:
+            self.pop(key)
+            entry = None
+
+        if entry == None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+
+    def put(self, key:Hashable, value:Any, version:Any=None, size:"int | None"=None):
+        '''
+        Caches a value.
+
+        `size` is the memory the value takes up in bytes, estimated if not passed.
+        '''
+        self.pop(key)
+
+        if size == None:
+            size = sys.getsizeof(value)
+
+        self.entries[key] = (value, size, version)
+        self.size += size
+
+        while len(self.entries) > self.max_size:
+            _, (_, old, _) = self.entries.popitem(last=False)
+            self.size -= old
+
+
+    def pop(self, key:Hashable):
+        '''
+        Removes a value from the cache.
+        '''
+        entry = self.entries.pop(key, None)
+
+        if entry != None:
+            self.size -= entry[1]
+
+
+    def stats(self) -> dict:
+        '''
+        Returns the cache statistics.
+        '''
+        lookups = self.hits+self.misses
+
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits/lookups if lookups else 0,
+            "bytes": self.size
+        }
+
+
+class TTLCache:
+    def __init__(self, ttl:float, max_size:int):
+        '''
+        A cache that drops entries that were not used for `ttl` seconds.
+
+        Once it is full, the least recently used entries are dropped too.
+        '''
+        self.ttl: float = ttl
+        self.max_size: int = max_size
+        self.entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+
+
+    def expire(self):
+        '''
+        Removes entries that were not used in time.
+
+        Entries are kept in the order they were used in,
+        so only the oldest ones have to be checked.
+        '''
+        now = time.monotonic()
+
+        while self.entries:
+            key, (_, used) = next(iter(self.entries.items()))
+            if now-used < self.ttl:
+                break
+            self.entries.popitem(last=False)
+
+
+    def get(self, key:Hashable) -> Any:
+        '''
+        Returns the cached value or None if it expired.
+        '''
+        self.expire()
+        entry = self.entries.get(key, None)
+
+        if entry == None:
+            return None
+
+        self.entries[key] = (entry[0], time.monotonic())
+        self.entries.move_to_end(key)
+        return entry[0]
+
+
+    def put(self, key:Hashable, value:Any):
+        '''
+        Caches a value.
+        '''
+        self.expire()
+        self.entries.pop(key, None)
+        self.entries[key] = (value, time.monotonic())
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
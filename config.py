@@ -6,6 +6,54 @@ MAX_PROMPT_LEN = 100
 NOTE_LEN = 100
 TAG_LEN = 20
 MAX_TAGS = 10
+MAX_IMPORT = 50000 # bookmarks a user can have after importing
+MAX_IMPORT_SIZE = 25*1024*1024 # bytes of an imported file
+MAX_EXPORT_SIZE = 10*1024*1024 # bytes of an exported file, the upload limit
+
+# search
+GRAM_LEN = 3 # length of n-grams in the search index
+INDEXED_ARGS = [ # search arguments answered by the index
+    'keyword', 'kw', 'text', 'note', 'tag', 'server', 'guild', 'channel',
+    'type', 'extension', 'ext', 'by', 'from', 'author',
+    'before', 'after', 'savedbefore', 'savedafter'
+]
+DATE_ARGS = ['before', 'after', 'savedbefore', 'savedafter'] # search arguments that take a date
+SEARCH_SORTS = { # /search sort options to sorts of the search index
+    'Newest saved': 'saved', 'Oldest saved': 'oldest', 'Newest sent': 'sent',
+    'Author': 'author', 'Most attachments': 'attachments'
+}
+SEARCH_CACHE_SIZE = 1000 # cached search results
+CACHE_REPORT_EVERY = 1000 # cache lookups between logging cache statistics
+SEARCH_SESSION_TTL = 900 # seconds an unused search stays pageable
+SEARCH_SESSIONS = 10000 # search sessions kept at once
+RENDER_CACHE_SIZE = 1000 # cached bookmark embeds and tag dropdowns
+SEARCH_OFFLOAD_SIZE = 5000 # bookmarks a user needs for their searches to run in the search threads
+INDEX_OFFLOAD_SIZE = 500 # bookmarks a user needs for building their indexes and sorting to run in the search threads
+SEARCH_THREADS = 4 # threads running large searches
+SEARCH_TIMEOUT = 10 # seconds a search can take before it is cancelled
+
+# storage
+STORAGE = 'file' # 'file' or 'sqlite'
+USERS_DB = 'users.db'
+JOURNAL_LIMIT = 1000 # journal records before compacting into users.json
+DURABILITY = 'batched' # 'immediate' writes every change before replying, 'batched' groups them
+FLUSH_INTERVAL = 500 # milliseconds between batched writes
+SNAPSHOT_FORMAT = 'json' # 'json', 'marshal' or 'msgpack', existing snapshots are detected
+SNAPSHOT_BACKUPS = 3 # previous snapshots of users.json to keep
+LAZY_LOAD = True # load users on first access instead of on startup
+
+# logging
+LOG_LEVEL = 'INFO' # 'INFO', 'SUCCESS', 'WARNING' or 'ERROR', lower levels are skipped
+LOG_FORMAT = 'text' # 'text' or 'json' for one JSON object per line
+LOG_MAX_SIZE = 5*1024*1024 # bytes before rotating log.txt, 0 to disable
+LOG_ROTATE_INTERVAL = 24*60*60 # seconds before rotating log.txt, 0 to disable
+LOG_BACKUPS = 5 # rotated log files to keep
+LOG_FLUSH_INTERVAL = 200 # milliseconds to collect records before writing them
+
+# metrics
+METRICS_FILE = 'metrics.txt' # text dump of the metrics, updated regularly
+METRICS_INTERVAL = 60 # seconds between metrics dumps
+LOOP_LAG_INTERVAL = 1 # seconds between event loop lag checks
 
 # emoji
 ATT  = '<:Attachment:1287408309720060065>' # "Attachment" emoji
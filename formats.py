@@ -0,0 +1,359 @@
+from typing import *
+
+import codecs
+import json
+import marshal
+import re
+import struct
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# snapshot formats
+
+class Format:
+    name: str = ''
+
+    def __init__(self):
+        '''
+        Base class for snapshot file formats.
+
+        A snapshot is a header, then every user as a record header followed
+        by the serialized user, then a footer. Users are serialized on their
+        own so they can be read back one by one.
+        '''
+        pass
+
+
+    def dumps(self, user:dict) -> bytes:
+        '''
+        Serializes a single user.
+        '''
+        raise NotImplementedError
+
+
+    def loads(self, data:bytes) -> dict:
+        '''
+        Deserializes a single user.
+        '''
+        raise NotImplementedError
+
+
+    def header(self) -> bytes:
+        '''
+        Returns the bytes a snapshot starts with.
+        '''
+        raise NotImplementedError
+
+
+    def record(self, id:int, length:int, first:bool) -> bytes:
+        '''
+        Returns the bytes that go before a serialized user.
+        '''
+        raise NotImplementedError
+
+
+    def footer(self) -> bytes:
+        '''
+        Returns the bytes a snapshot ends with.
+        '''
+        return b''
+
+
+    def load(self, file:BinaryIO) -> Dict[int, dict]:
+        '''
+        Reads all users from a snapshot.
+        '''
+        return dict(self.iter_load(file))
+
+
+    def iter_load(self, file:BinaryIO) -> Iterator[Tuple[int, dict]]:
+        '''
+        Reads users from a snapshot one by one, so only one
+        of them has to be in memory at a time.
+        '''
+        raise NotImplementedError
+
+
+    def detect(self, head:bytes) -> bool:
+        '''
+        Returns whether a snapshot starting with the given bytes is in this format.
+        '''
+        raise NotImplementedError
+
+
+class JsonFormat(Format):
+    name = 'json'
+
+    def __init__(self):
+        '''
+        The original `{"users": {...}}` JSON file.
+
+        Uses orjson if it is installed.
+        '''
+        super().__init__()
+
+
+    def dumps(self, user:dict) -> bytes:
+        if orjson != None:
+            return orjson.dumps(user)
+        return json.dumps(user, ensure_ascii=False).encode()
+
+
+    def loads(self, data:bytes) -> dict:
+        if orjson != None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+
+    def header(self) -> bytes:
+        return b'{"users": {'
+
+
+    def record(self, id:int, length:int, first:bool) -> bytes:
+        return ('' if first else ', ').encode()+f'"{id}": '.encode()
+
+
+    def footer(self) -> bytes:
+        return b'}}'
+
+
+    def load(self, file:BinaryIO) -> Dict[int, dict]:
+        data = self.loads(file.read())
+        return {int(id): user for id, user in data['users'].items()}
+
+
+    def iter_load(self, file:BinaryIO, chunk:int=1024*1024) -> Iterator[Tuple[int, dict]]:
+        reader = JsonReader(file, chunk)
+
+        reader.expect('{')
+        while not reader.next_is('}'):
+            key = reader.value()
+            reader.expect(':')
+
+            if key != 'users':
+                reader.value()
+            else:
+                # parsing users one at a time
+                reader.expect('{')
+                while not reader.next_is('}'):
+                    id = reader.value()
+                    reader.expect(':')
+                    yield int(id), reader.value()
+                    reader.separator('}')
+                reader.expect('}')
+
+            reader.separator('}')
+
+
+    def detect(self, head:bytes) -> bool:
+        return head.lstrip()[:1] == b'{'
+
+
+# characters numbers and literals like `true` or `-Infinity` are made of
+SCALAR = re.compile(r'[\w.+-]*')
+
+
+class JsonReader:
+    def __init__(self, file:BinaryIO, chunk:int):
+        '''
+        Reads JSON values one by one from a file without reading the whole file.
+
+        Only the values that are asked for are decoded, the structure around
+        them is walked with `expect`, `next_is` and `separator`.
+        '''
+        self.file: BinaryIO = file
+        self.chunk: int = chunk
+        self.decoder: codecs.IncrementalDecoder = codecs.getincrementaldecoder('utf-8')()
+        self.json: json.JSONDecoder = json.JSONDecoder()
+        self.buffer: str = ''
+        self.pos: int = 0
+        self.eof: bool = False
+
+
+    def read(self, size:int) -> bool:
+        '''
+        Reads more of the file into the buffer.
+
+        Returns False if the file has ended.
+        '''
+        if self.eof:
+            return False
+
+        data = self.file.read(size)
+        self.eof = not data
+
+        # dropping what was already parsed
+        self.buffer = self.buffer[self.pos:]+self.decoder.decode(data, self.eof)
+        self.pos = 0
+        return not self.eof
+
+
+    def skip(self) -> str:
+        '''
+        Skips whitespace and returns the next character or an empty string at the end.
+        '''
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+
+            if self.pos < len(self.buffer) or not self.read(self.chunk):
+                return self.buffer[self.pos:self.pos+1]
+
+
+    def next_is(self, char:str) -> bool:
+        '''
+        Returns whether the next character is the given one, without consuming it.
+        '''
+        return self.skip() == char
+
+
+    def expect(self, char:str):
+        '''
+        Consumes the given character.
+        '''
+        if self.skip() != char:
+            raise ValueError(f'Expected {char!r} at {self.pos}')
+        self.pos += 1
+
+
+    def separator(self, end:str):
+        '''
+        Consumes a comma between values, the closing character is left in place.
+        '''
+        if not self.next_is(end):
+            self.expect(',')
+
+
+    def value(self) -> Any:
+        '''
+        Decodes the next value.
+
+        If the buffer ends inside of it, more is read and decoding starts
+        over, with the amount read doubling so large values are not
+        decoded again too many times.
+        '''
+        self.skip()
+        size = self.chunk
+
+        while True:
+            # numbers and literals are decoded even if they are cut off, `0.`
+            # could still be `0.5`, so they are only decoded once they end
+            scalar = self.buffer[self.pos:self.pos+1] not in ('{', '[', '"')
+            if scalar and not self.eof and SCALAR.match(self.buffer, self.pos).end() == len(self.buffer):
+                self.read(size)
+                size *= 2
+                continue
+
+            try:
+                value, end = self.json.raw_decode(self.buffer, self.pos)
+                self.pos = end
+                return value
+
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+
+            self.read(size)
+            size *= 2
+
+
+class BinaryFormat(Format):
+    MAGIC = b'BMDB\x01'
+    RECORD = struct.Struct('<QI') # user id, length
+    CODECS = {'marshal': 1, 'msgpack': 2}
+
+    def __init__(self, codec:str):
+        '''
+        Length-prefixed binary records.
+
+        Users are serialized with `marshal` or with `msgpack` if it is installed.
+        Snapshots in this format are only meant to be read by the bot itself.
+        '''
+        super().__init__()
+
+        if codec == 'msgpack' and msgpack == None:
+            raise ImportError('msgpack is not installed')
+
+        self.name: str = codec
+        self.codec: int = self.CODECS[codec]
+
+
+    def dumps(self, user:dict) -> bytes:
+        if self.codec == 1:
+            return marshal.dumps(user, 4)
+        return msgpack.packb(user, use_bin_type=True)
+
+
+    def loads(self, data:bytes) -> dict:
+        if self.codec == 1:
+            return marshal.loads(data)
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+    def header(self) -> bytes:
+        return self.MAGIC+bytes([self.codec])
+
+
+    def record(self, id:int, length:int, first:bool) -> bytes:
+        return self.RECORD.pack(id, length)
+
+
+    def iter_load(self, file:BinaryIO) -> Iterator[Tuple[int, dict]]:
+        if file.read(len(self.MAGIC)+1) != self.header():
+            raise ValueError('Not a snapshot in this format')
+
+        while True:
+            head = file.read(self.RECORD.size)
+            if not head:
+                break
+
+            id, length = self.RECORD.unpack(head)
+            data = file.read(length)
+            if len(data) != length:
+                raise ValueError('Snapshot is truncated')
+
+            yield id, self.loads(data)
+
+
+    def detect(self, head:bytes) -> bool:
+        return head[:len(self.MAGIC)+1] == self.header()
+
+
+def get_format(name:str) -> Format:
+    '''
+    Returns a snapshot format by its name.
+    '''
+    if name == 'json':
+        return JsonFormat()
+    if name in BinaryFormat.CODECS:
+        return BinaryFormat(name)
+
+    raise ValueError(f'Unknown snapshot format: {name}')
+
+
+def detect_format(path:str) -> Format:
+    '''
+    Returns the format of a snapshot file.
+    '''
+    with open(path, 'rb') as f:
+        head = f.read(16)
+
+    for name in ['json']+list(BinaryFormat.CODECS):
+        try:
+            format = get_format(name)
+        except ImportError:
+            continue
+
+        if format.detect(head):
+            return format
+
+    raise ValueError(f'Unknown format of {path}')
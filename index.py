@@ -0,0 +1,652 @@
+from typing import *
+
+from config import *
+import bisect
+import heapq
+import itertools
+import operator
+import re
+
+
+# helpers
+
+def grams(string:str) -> Set[str]:
+    '''
+    Returns all n-grams of a string.
+
+    The string is casefolded, so the n-grams can be used for both
+    case-sensitive and case-insensitive lookups.
+    '''
+    string = string.casefold()
+    return {string[i:i+GRAM_LEN] for i in range(len(string)-GRAM_LEN+1)}
+
+
+def words(string:str) -> Set[str]:
+    '''
+    Returns all casefolded words of a string.
+    '''
+    return set(re.findall(r'\w+', string.casefold()))
+
+
+def insort(ids:list, id:Any):
+    '''
+    Inserts an item into a sorted list if it is not there yet.
+    '''
+    index = bisect.bisect_left(ids, id)
+
+    if index == len(ids) or ids[index] != id:
+        ids.insert(index, id)
+
+
+def unsort(ids:list, id:Any):
+    '''
+    Removes an item from a sorted list if it is there.
+    '''
+    if contains(ids, id):
+        del ids[bisect.bisect_left(ids, id)]
+
+
+def contains(ids:list, id:Any) -> bool:
+    '''
+    Returns whether a sorted list has the item.
+    '''
+    index = bisect.bisect_left(ids, id)
+    return index < len(ids) and ids[index] == id
+
+
+def prefixed(items:List[str], prefix:str) -> range:
+    '''
+    Returns the range of positions of items starting with the prefix in a sorted list.
+    '''
+    start = bisect.bisect_left(items, prefix)
+    end = bisect.bisect_left(items, prefix+'\U0010ffff')
+    return range(start, end)
+
+
+def intersect(sets:List[Set[int]]) -> Set[int]:
+    '''
+    Intersects the sets starting with the smallest one.
+    '''
+    if not sets:
+        return set()
+
+    sets = sorted(sets, key=len)
+    out = set(sets[0])
+
+    for i in sets[1:]:
+        if not out:
+            break
+        out &= i
+
+    return out
+
+
+# orders
+
+# keys messages are kept sorted by
+ORDER_KEYS: Dict[str, Callable[["Message"], tuple]] = {
+    'saved': lambda m: (m.saved_at, m.id),
+    'sent': lambda m: (m.sent_at, m.id),
+    'author': lambda m: (m.folded_author, m.id),
+    'attachments': lambda m: (len(m.attachments), m.id)
+}
+
+# search result sorts to an order and whether it is reversed
+SORTS: Dict[str, Tuple[str, bool]] = {
+    'saved': ('saved', True),
+    'oldest': ('saved', False),
+    'sent': ('sent', True),
+    'author': ('author', False),
+    'attachments': ('attachments', True)
+}
+
+
+class Orders:
+    def __init__(self, saved:"Dict[int, Message]"):
+        '''
+        A user's saved messages sorted by everything search results
+        can be sorted by.
+
+        Every order is sorted on first use and only used orders are kept
+        up to date. Pages of all messages by save time come from the order
+        of `saved`, which is the order they were saved in, and never
+        need sorting. Imported messages are added last with the save times
+        they were exported with, so that is only done while `saved` agrees
+        with the saved order.
+        '''
+        self.saved: "Dict[int, Message]" = saved
+        self.keys: Dict[str, List[tuple]] = {} # order names to sorted keys
+        self.ordered: "bool | None" = None # whether `saved` is in the saved order, None if it has to be checked again
+        self.last: "tuple | None" = None # key of the newest message while ordered
+        self.in_order()
+
+
+    def in_order(self) -> bool:
+        '''
+        Returns whether `saved` is in the saved order, checking it if needed.
+        '''
+        if self.ordered == None:
+            keys = list(map(operator.attrgetter('saved_at', 'id'), self.saved.values()))
+            self.ordered = all(map(operator.lt, keys, keys[1:]))
+            self.last = keys[-1] if keys else None
+
+        return self.ordered
+
+
+    def get(self, name:str) -> List[tuple]:
+        '''
+        Returns the sorted keys of an order, sorting them if needed.
+        '''
+        keys = self.keys.get(name, None)
+
+        if keys == None:
+            key = ORDER_KEYS[name]
+            keys = self.keys[name] = sorted(key(i) for i in self.saved.values())
+
+        return keys
+
+
+    def ready(self, sort:str, everything:bool) -> bool:
+        '''
+        Returns whether pages in the sort can be made without sorting first.
+
+        `everything` is whether the pages are of all messages.
+        '''
+        name = SORTS[sort][0]
+        return name in self.keys or (everything and name == 'saved' and self.ordered == True)
+
+
+    def prepare(self, sort:str, everything:bool):
+        '''
+        Sorts or checks what pages in the sort need, so `ready` is true after.
+        '''
+        name = SORTS[sort][0]
+
+        if name not in self.keys and not (everything and name == 'saved' and self.in_order()):
+            self.get(name)
+
+
+    def add(self, message:"Message"):
+        '''
+        Adds a message to the sorted orders.
+
+        Messages are added after they are put last in `saved`.
+        '''
+        for name, keys in self.keys.items():
+            insort(keys, ORDER_KEYS[name](message))
+
+        # the newest message may have been removed since,
+        # so an older one only means checking again
+        if self.ordered == True:
+            key = ORDER_KEYS['saved'](message)
+
+            if self.last != None and key < self.last:
+                self.ordered = None
+            else:
+                self.last = key
+
+
+    def remove(self, message:"Message"):
+        '''
+        Removes a message from the sorted orders.
+        '''
+        for name, keys in self.keys.items():
+            unsort(keys, ORDER_KEYS[name](message))
+
+
+    # notes and tags are not sorted by
+
+    def set_note(self, message:"Message", old:str):
+        pass
+
+
+    def add_tag(self, message:"Message", tag:str):
+        pass
+
+
+    def remove_tag(self, message:"Message", tag:str):
+        pass
+
+
+    def order(
+        self, sort:str, ids:"Set[int] | None", start:int, count:int
+    ) -> "List[Message]":
+        '''
+        Returns a page of messages in the given sort.
+
+        `ids` are the messages to sort, all of them if None. When most
+        messages are in `ids`, the kept order is walked until the page
+        is filled, otherwise only the first `start+count` messages
+        are picked with a heap instead of sorting all of them.
+        '''
+        name, descending = SORTS[sort]
+        end = start+count
+
+        # all messages in the order they were saved in
+        if ids == None and name == 'saved' and self.in_order():
+            messages = reversed(self.saved.values()) if descending else iter(self.saved.values())
+            return list(itertools.islice(messages, start, end))
+
+        keys = self.get(name)
+
+        # all messages
+        if ids == None:
+            if descending:
+                part = keys[max(len(keys)-end, 0):max(len(keys)-start, 0)][::-1]
+            else:
+                part = keys[start:end]
+            return [self.saved[i[-1]] for i in part]
+
+        # walking is about `end*len(keys)/len(ids)` steps
+        if end*len(keys) < len(ids)**2:
+            out = []
+            seen = 0
+
+            for i in (reversed(keys) if descending else keys):
+                if i[-1] not in ids:
+                    continue
+
+                if seen >= start:
+                    out.append(self.saved[i[-1]])
+                    if len(out) >= count:
+                        break
+                seen += 1
+
+            return out
+
+        # top k
+        messages = [self.saved[i] for i in ids if i in self.saved]
+        pick = heapq.nlargest if descending else heapq.nsmallest
+        return pick(end, messages, key=ORDER_KEYS[name])[start:end]
+
+
+# index
+
+class SearchIndex:
+    def __init__(self, saved:"Dict[int, Message]", orders:Orders):
+        '''
+        Index over a user's saved messages.
+
+        Text and notes are indexed by n-grams, tags, authors, servers,
+        channels and attachment types and extensions are mapped to the
+        messages that have them. Dates are looked up in the orders
+        by send and save times, which are sorted with the index.
+
+        Lookups return candidates that may match the value, the caller
+        still has to check them.
+        '''
+        self.saved: "Dict[int, Message]" = saved
+        self.orders: Orders = orders
+        self.text: Dict[str, Set[int]] = {}
+        self.note: Dict[str, Set[int]] = {}
+        self.tags: Dict[str, Set[int]] = {}
+        self.authors: Dict[str, Set[int]] = {}
+        self.guilds: Dict[str, Set[int]] = {}
+        self.channels: Dict[str, Set[int]] = {}
+        self.types: Dict[str, Set[int]] = {}
+        self.extensions: Dict[str, Set[int]] = {}
+
+        for i in saved.values():
+            self.add(i)
+
+        self.orders.get('saved')
+        self.orders.get('sent')
+
+
+    def add_grams(self, index:Dict[str, Set[int]], string:str, id:int):
+        '''
+        Adds the n-grams of a string to the index.
+        '''
+        for i in grams(string):
+            ids = index.get(i, None)
+
+            if ids == None:
+                index[i] = {id}
+            else:
+                ids.add(id)
+
+
+    def remove_grams(self, index:Dict[str, Set[int]], string:str, id:int):
+        '''
+        Removes the n-grams of a string from the index.
+        '''
+        for i in grams(string):
+            self.remove_key(index, i, id)
+
+
+    def add_key(self, index:Dict[str, Set[int]], key:str, id:int):
+        '''
+        Maps a key to a message in the index.
+        '''
+        index.setdefault(key, set()).add(id)
+
+
+    def remove_key(self, index:Dict[str, Set[int]], key:str, id:int):
+        '''
+        Unmaps a key from a message in the index.
+        '''
+        ids = index.get(key, None)
+        if ids == None:
+            return
+
+        ids.discard(id)
+        if not ids:
+            index.pop(key)
+
+
+    def keys(self, message:"Message") -> List[Tuple[Dict[str, Set[int]], str]]:
+        '''
+        Returns all keys a message is mapped to, except for tags.
+        '''
+        keys = [
+            (self.authors, message.folded_author),
+            (self.authors, str(message.author_id)),
+            (self.guilds, str(message.guild_id).lower()),
+            (self.channels, str(message.channel_id))
+        ]
+
+        for i in message.attachments:
+            keys.append((self.types, i.type.lower()))
+            keys.append((self.extensions, i.extension.lower()))
+
+        return keys
+
+
+    def add(self, message:"Message"):
+        '''
+        Indexes a message.
+        '''
+        self.add_grams(self.text, message.text, message.id)
+        self.add_grams(self.note, message.note, message.id)
+
+        for index, key in self.keys(message):
+            self.add_key(index, key, message.id)
+
+        for i in message.tags:
+            self.add_tag(message, i)
+
+
+    def remove(self, message:"Message"):
+        '''
+        Removes a message from the index.
+        '''
+        self.remove_grams(self.text, message.text, message.id)
+        self.remove_grams(self.note, message.note, message.id)
+
+        for index, key in self.keys(message):
+            self.remove_key(index, key, message.id)
+
+        for i in message.tags:
+            self.remove_tag(message, i)
+
+
+    def set_note(self, message:"Message", old:str):
+        '''
+        Reindexes the note of a message.
+        '''
+        self.remove_grams(self.note, old, message.id)
+        self.add_grams(self.note, message.note, message.id)
+
+
+    def add_tag(self, message:"Message", tag:str):
+        '''
+        Indexes a tag of a message.
+        '''
+        self.add_key(self.tags, tag, message.id)
+
+
+    def remove_tag(self, message:"Message", tag:str):
+        '''
+        Removes a tag of a message from the index.
+        '''
+        self.remove_key(self.tags, tag, message.id)
+
+
+    def lookup(self, index:Dict[str, Set[int]], value:str) -> "Set[int] | None":
+        '''
+        Returns IDs of messages that may contain the value.
+
+        Returns None if the value is too short to be looked up.
+        '''
+        keys = grams(value)
+        if not keys:
+            return None
+
+        return intersect([index.get(i, set()) for i in keys])
+
+
+    def union(self, index:Dict[str, Set[int]], keys:List[str]) -> Set[int]:
+        '''
+        Returns IDs of messages that are mapped to any of the keys.
+        '''
+        out = set()
+
+        for i in keys:
+            out |= index.get(i, set())
+
+        return out
+
+
+    def candidates(self, arg:str, value:str) -> "List[Message] | None":
+        '''
+        Returns messages that may match a search argument.
+
+        The value has to be processed by `handle_arg` already. Returns None
+        if the argument is not indexed or every message has to be checked.
+        '''
+        # text
+        if arg in ['keyword', 'kw']:
+            text = self.lookup(self.text, value)
+            note = self.lookup(self.note, value)
+            if text == None or note == None:
+                return None
+
+            ids = text | note | self.tags.get(value.lower().replace(' ','_'), set())
+
+        elif arg == 'text':
+            ids = self.lookup(self.text, value)
+
+        elif arg == 'note':
+            ids = self.lookup(self.note, value)
+
+        # equality
+        elif arg == 'tag':
+            ids = self.tags.get(value.lower().replace(' ','_'), set())
+
+        elif arg in ['server','guild']:
+            ids = self.union(self.guilds, value.lower().split(' '))
+
+        elif arg in ['channel']:
+            ids = self.union(self.channels, value.split(' '))
+
+        elif arg == 'type':
+            ids = self.union(self.types, value.lower().split(' '))
+
+        elif arg in ['extension','ext']:
+            ids = self.union(self.extensions, [
+                i.removeprefix('.') for i in value.lower().split(' ')
+            ])
+
+        elif arg in DATE_ARGS:
+            times = self.orders.get('saved' if arg.startswith('saved') else 'sent')
+            split = bisect.bisect_left(times, (float(value),))
+            part = times[:split] if arg.endswith('before') else times[split:]
+
+            return [self.saved[id] for _, id in part]
+
+        elif arg in ['by','from','author']:
+            value = value.casefold().replace(' ','_')
+            value = value.removeprefix('<@').removesuffix('>')
+            ids = self.authors.get(value, set())
+
+        else:
+            return None
+
+        if ids == None:
+            return None
+
+        return [self.saved[i] for i in ids]
+
+
+# autocomplete
+
+class Completions:
+    def __init__(self, saved:"Dict[int, Message]"):
+        '''
+        Index for the manage command autocomplete.
+
+        Keeps the sorted IDs and maps note words and tags to the IDs of
+        the messages that have them. Much cheaper to build than the search
+        index, so autocomplete does not have to wait for n-grams.
+        '''
+        self.saved: "Dict[int, Message]" = saved
+        self.ids: List[str] = sorted(str(i) for i in saved) # sorted IDs as strings
+        self.words: Dict[str, List[int]] = {} # note and tag words to sorted IDs
+
+        # sorting once instead of inserting in place
+        for i in saved.values():
+            for word in self.message_words(i):
+                self.words.setdefault(word, []).append(i.id)
+
+        for i in self.words.values():
+            i.sort()
+
+        self.vocabulary: List[str] = sorted(self.words) # sorted words
+
+
+    def message_words(self, message:"Message") -> Set[str]:
+        '''
+        Returns the words of a message's note and tags that autocomplete looks for.
+        '''
+        return words(message.note) | set(message.tags)
+
+
+    def reword(self, message:"Message", old:Set[str], new:"Set[str] | None"=None):
+        '''
+        Updates the autocomplete words of a message.
+
+        `old` is the set of words the message had before, `new` is
+        the set it has now, taken from the message if not passed.
+        '''
+        if new == None:
+            new = self.message_words(message)
+
+        for i in old - new:
+            ids = self.words.get(i, [])
+            unsort(ids, message.id)
+
+            if not ids:
+                self.words.pop(i, None)
+                unsort(self.vocabulary, i)
+
+        for i in new - old:
+            if i not in self.words:
+                self.words[i] = []
+                insort(self.vocabulary, i)
+
+            insort(self.words[i], message.id)
+
+
+    def add(self, message:"Message"):
+        '''
+        Adds a message to the autocomplete.
+        '''
+        insort(self.ids, str(message.id))
+        self.reword(message, set())
+
+
+    def remove(self, message:"Message"):
+        '''
+        Removes a message from the autocomplete.
+        '''
+        unsort(self.ids, str(message.id))
+        self.reword(message, self.message_words(message), set())
+
+
+    def set_note(self, message:"Message", old:str):
+        '''
+        Updates the words of a message after its note changed.
+        '''
+        self.reword(message, words(old) | set(message.tags))
+
+
+    def add_tag(self, message:"Message", tag:str):
+        '''
+        Adds a tag of a message to the autocomplete.
+        '''
+        self.reword(message, words(message.note) | set(message.tags) - {tag})
+
+
+    def remove_tag(self, message:"Message", tag:str):
+        '''
+        Removes a tag of a message from the autocomplete.
+        '''
+        self.reword(message, self.message_words(message) | {tag})
+
+
+    def complete(self, current:str, limit:int) -> "List[Message]":
+        '''
+        Returns bookmarks for the manage command autocomplete.
+
+        Bookmarks whose ID starts with the input come first, then bookmarks
+        with a note word or tag starting with the last word of the input
+        and containing the other words. Newer messages come first
+        and the lookup stops once enough bookmarks are found.
+        '''
+        current = current.strip().casefold()
+
+        if current == '':
+            out = []
+
+            for i in reversed(self.saved):
+                if len(out) >= limit:
+                    break
+                out.append(self.saved[i])
+
+            return out
+
+        out: Dict[int, Message] = {}
+
+        # id prefix, larger snowflakes are newer
+        for i in reversed(prefixed(self.ids, current)):
+            if len(out) >= limit:
+                return list(out.values())
+            out[int(self.ids[i])] = self.saved[int(self.ids[i])]
+
+        # note words and tags
+        *full, prefix = current.split()
+        full = set(full)
+        if any(i not in self.words for i in full):
+            return list(out.values())
+
+        lists = [self.words[self.vocabulary[i]]
+            for i in prefixed(self.vocabulary, prefix)]
+        required = sorted((self.words[i] for i in full), key=len)
+
+        # walking the shorter side and checking the other one
+        if required and len(required[0]) < sum(len(i) for i in lists):
+            candidates = reversed(required.pop(0))
+            check_prefix = True
+        else:
+            candidates = heapq.merge(*[reversed(i) for i in lists], reverse=True)
+            check_prefix = False
+
+        for i in candidates:
+            if len(out) >= limit:
+                break
+            if i in out:
+                continue
+
+            if not all(contains(ids, i) for ids in required):
+                continue
+
+            message = self.saved[i]
+            if check_prefix and not any(
+                j.startswith(prefix) for j in self.message_words(message)
+            ):
+                continue
+
+            out[i] = message
+
+        return list(out.values())
+
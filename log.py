@@ -1,35 +1,195 @@
 import colorama
 import datetime
+import atexit
+import json
+import os
+import queue
+import threading
+import time
 import config
+from typing import *
 colorama.init()
 
 # levels
 class Level:
-    def __init__(self, name, color):
+    def __init__(self, name, color, value):
         self.name = name
         self.color = color
+        self.value = value
+
+INFO =    Level("INFO   ", colorama.Fore.LIGHTBLUE_EX, 20)
+SUCCESS = Level("SUCCESS", colorama.Fore.LIGHTGREEN_EX, 25)
+WARNING = Level("WARNING", colorama.Fore.LIGHTYELLOW_EX, 30)
+ERROR =   Level("ERROR  ", colorama.Fore.LIGHTRED_EX, 40)
+
+LEVELS = {i.name.strip(): i for i in [INFO, SUCCESS, WARNING, ERROR]}
+THRESHOLD = LEVELS[config.LOG_LEVEL].value
+
+
+# writer
+class LogWriter:
+    def __init__(self, path:str):
+        '''
+        Writes queued log records from a background thread.
+
+        Records are written in batches to a file that is kept open
+        and rotated once it gets too big or too old.
+        '''
+        self.path: str = path
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.file = None
+        self.opened_at: float = 0
+        self.thread: threading.Thread = threading.Thread(
+            target=self.run, name='log-writer', daemon=True
+        )
+        self.thread.start()
+
+
+    def open(self):
+        '''
+        Opens the log file for appending.
+        '''
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.opened_at = time.time()
+
+
+    def rotate(self):
+        '''
+        Moves the log file to `.1`, shifting older ones and dropping the oldest.
+        '''
+        self.file.close()
+
+        for i in range(config.LOG_BACKUPS-1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i+1}')
+
+        if config.LOG_BACKUPS > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+
+        self.open()
+
+
+    def should_rotate(self, size:int) -> bool:
+        '''
+        Returns whether the file has to be rotated before writing `size` more characters.
+        '''
+        if config.LOG_ROTATE_INTERVAL and \
+            time.time()-self.opened_at >= config.LOG_ROTATE_INTERVAL:
+                return self.file.tell() > 0
+
+        return config.LOG_MAX_SIZE and self.file.tell() > 0 and \
+            self.file.tell()+size > config.LOG_MAX_SIZE
+
+
+    def format(self, record:tuple) -> "Tuple[str, str | None]":
+        '''
+        Formats a record for the console and the file.
+        '''
+        created, text, origin, level, to_file = record
+
+        ct = datetime.datetime.fromtimestamp(created)
+        ts = ct.strftime('%Y-%m-%d %H:%M:%S')
+
+        console = f'{level.color}[{level.name}]{colorama.Fore.RESET} [{ts}] [{origin}] {text}'
+
+        if not to_file:
+            return console, None
+
+        if config.LOG_FORMAT == 'json':
+            line = json.dumps({
+                "time": ct.isoformat(timespec='milliseconds'),
+                "level": level.name.strip(),
+                "origin": origin,
+                "text": text
+            }, ensure_ascii=False)
+        else:
+            line = f'[{level.name}] [{ts}] [{origin}] {text}'
+
+        return console, line+'\n'
+
+
+    def write(self, records:list):
+        '''
+        Writes a batch of records.
+        '''
+        lines = []
+
+        for i in records:
+            console, line = self.format(i)
+            print(console)
+
+            if line != None:
+                lines.append(line)
+
+        if not lines:
+            return
+
+        if self.file == None:
+            self.open()
+
+        data = ''.join(lines)
+        if self.should_rotate(len(data)):
+            self.rotate()
+
+        self.file.write(data)
+        self.file.flush()
+
+
+    def run(self):
+        '''
+        Writes records until a None is queued.
+        '''
+        running = True
+
+        while running:
+            records = [self.queue.get()]
+
+            # collecting everything queued since
+            time.sleep(config.LOG_FLUSH_INTERVAL/1000)
+            while True:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in records:
+                running = False
+                records = [i for i in records if i != None]
+
+            try:
+                self.write(records)
+            except Exception as e:
+                print(f'Unable to write logs: {e}')
+
+        if self.file != None:
+            self.file.close()
+
+
+    def close(self):
+        '''
+        Writes all queued records and stops the thread.
+        '''
+        if not self.thread.is_alive():
+            return
+
+        self.queue.put(None)
+        self.thread.join()
+
+
+log_writer = LogWriter(config.LOG_FILE)
+atexit.register(log_writer.close)
 
-INFO =    Level("INFO   ", colorama.Fore.LIGHTBLUE_EX)
-SUCCESS = Level("SUCCESS", colorama.Fore.LIGHTGREEN_EX)
-WARNING = Level("WARNING", colorama.Fore.LIGHTYELLOW_EX)
-ERROR =   Level("ERROR  ", colorama.Fore.LIGHTRED_EX)
 
 # log
 def log(text:str, origin:str='bot', level:Level=INFO, to_file:bool=True):
     '''
     Logs a message in the console and/or the file.
-    '''
-    ct = datetime.datetime.now()
-    time = f'{ct.year}-{ct.month:0>2}-{ct.day:0>2} {ct.hour:0>2}:{ct.minute:0>2}:{ct.second:0>2}'
-
-    # logging to console
-    string = f'{level.color}[{level.name}]{colorama.Fore.RESET} [{time}] [{origin}] {text}'
-    print(string)
 
-    # logging to file
-    if not to_file:
+    The record is only queued, it is formatted and written by the log writer.
+    '''
+    if level.value < THRESHOLD:
         return
-    
-    with open(config.LOG_FILE, 'a', encoding='utf-8') as file:
-        string = f'[{level.name}] [{time}] [{origin}] {text}\n'
-        file.write(string)
\ No newline at end of file
+
+    log_writer.queue.put((time.time(), text, origin, level, to_file))
@@ -1,12 +1,20 @@
 import time
 import api
+import asyncio
+import cache
+import storage
 from config import *
 from log import *
+from metrics import metrics
 
 import discord
+import functools
 from discord.ext import commands
 from dotenv import load_dotenv
 import os
+import secrets
+import signal
+import tempfile
 from typing import *
 
 import utils
@@ -16,24 +24,87 @@ load_dotenv()
 TOKEN = os.getenv('BOT_TOKEN')
 
 bot = commands.Bot(command_prefix=PREFIX, intents=discord.Intents.default(), help_command=None)
-mg = api.Manager(USERS_FILE)
+mg = api.Manager(storage.get_storage(
+    STORAGE, USERS_DB if STORAGE == 'sqlite' else USERS_FILE
+))
+sessions = cache.TTLCache(SEARCH_SESSION_TTL, SEARCH_SESSIONS)
+renders = cache.LRUCache(RENDER_CACHE_SIZE)
+tasks: List[asyncio.Task] = []
+
+# metrics
+metrics.gauge('storage_bytes', mg.storage.size)
+metrics.gauge('users_loaded', lambda: len(mg.users))
+metrics.gauge('search_cache_hit_rate', lambda: round(mg.search_cache.stats()['hit_rate'], 3))
+metrics.gauge('render_cache_hit_rate', lambda: round(renders.stats()['hit_rate'], 3))
+metrics.gauge('search_sessions', lambda: len(sessions.entries))
+metrics.gauge('search_queue_depth', lambda: mg.searches_queued)
+metrics.gauge('searches_running', lambda: mg.searches_running)
 
 # functions
 
+def locked(func:Callable) -> Callable:
+    '''
+    Decorator that runs an interaction handler while holding
+    the lock of the user that made the interaction.
+    '''
+    @functools.wraps(func)
+    async def wrapper(inter:discord.Interaction, *args, **kwargs):
+        async with mg.lock(inter.user.id):
+            return await func(inter, *args, **kwargs)
+
+    return wrapper
+
+
+@metrics.timed('bot.export_file')
+def export_file(user:int) -> IO[bytes]:
+    '''
+    Writes a user's bookmarks into a temporary file, line by line
+    instead of building the whole file in memory.
+
+    Runs in a thread, so the user has to be loaded on the event loop first.
+    '''
+    file = tempfile.TemporaryFile()
+
+    for i in mg.export(user):
+        file.write(i)
+
+    return file
+
+
+def get_render(key:Tuple[str, int], version:int) -> Any:
+    '''
+    Returns a cached render of a bookmark or None if it changed since.
+    '''
+    out = renders.get(key, version)
+
+    if (renders.hits+renders.misses) % CACHE_REPORT_EVERY == 0:
+        stats = renders.stats()
+        log(f'Render cache: {stats["entries"]} entries, '\
+            f'{stats["hit_rate"]:.0%} hit rate', 'main')
+
+    return out
+
+
 def get_paginated_embed(
-    page:int, results:List[api.Message]
-) -> Tuple[discord.Embed, List[api.Message], int]:
+    page:int, results:"FrozenSet[int] | None", sort:str, user:int
+) -> Tuple[discord.Embed, List[api.Message], int, int]:
     '''
-    Converts a list of search results to a paginated embed.
+    Converts search result IDs to a paginated embed.
+
+    Only the bookmarks on the shown page are sorted and looked up,
+    ones that were removed since searching are skipped.
     '''
-    max_page = int(len(results)/PAGE_LEN) + \
-        (1 if len(results)%PAGE_LEN != 0 else 0)
+    total = len(results) if results != None else len(mg.get_user(user).saved)
+    max_page = int(total/PAGE_LEN) + \
+        (1 if total%PAGE_LEN != 0 else 0)
     page = min(max(page, 1), max_page)
-    stripped: List[api.Message] = results[(page-1)*PAGE_LEN:page*PAGE_LEN]
+    stripped: List[api.Message] = mg.page(
+        user, results, sort, max(page-1, 0)*PAGE_LEN, PAGE_LEN
+    )
 
     embed = discord.Embed(
         color=discord.Color.green(),
-        title=f"**Found {len(results)} bookmarks**"
+        title=f"**Found {total} bookmarks**"
     )
     
     for i in stripped:
@@ -48,9 +119,56 @@ def get_paginated_embed(
             
         embed.add_field(name=utils.shorten_string(i.note, NOTE_LEN), value=desc, inline=False)
     embed.set_footer(text=f'Showing page {page} of {max_page}')
-    return (embed, stripped, page)
+    return (embed, stripped, page, max_page)
 
 
+def get_paginated_view(
+    session:str, page:int, max_page:int, elements:List[api.Message]
+) -> discord.ui.View:
+    '''
+    Returns the view of a search results page.
+
+    Page buttons have the page to go to and the search session in their custom id.
+    '''
+    view = discord.ui.View()
+
+    if elements:
+        dd = discord.ui.Select(
+            placeholder='Manage...',
+            min_values=1,
+            max_values=1,
+            custom_id='b',
+            options=[
+                discord.SelectOption(
+                    label=i.note,
+                    description=f'{i.author_name} - {i.id}',
+                    value=f'{i.id}',
+                ) for i in elements
+            ]
+        )
+        view.add_item(dd)
+
+    if max_page > 1:
+        prev_button = discord.ui.Button(
+            style=discord.ButtonStyle.gray,
+            label='Previous',
+            custom_id=f'p{page-1}:{session}',
+            row=1,
+            disabled=page <= 1
+        )
+        view.add_item(prev_button)
+
+        next_button = discord.ui.Button(
+            style=discord.ButtonStyle.gray,
+            label='Next',
+            custom_id=f'p{page+1}:{session}',
+            row=1,
+            disabled=page >= max_page
+        )
+        view.add_item(next_button)
+
+    return view
+
 
 def get_manage_view(
     bm:api.Message,
@@ -95,13 +213,19 @@ def get_manage_view(
         view.add_item(t_button)
 
         if bm.tags != []:
+            options = get_render(('tags', bm.id), bm.version)
+
+            if options == None:
+                options = [
+                    discord.SelectOption(label=i, value=i) for i in bm.tags
+                ]
+                renders.put(('tags', bm.id), options, bm.version)
+
             t_dropdown = discord.ui.Select(
                 placeholder='Remove tags...',
                 min_values=1,
                 max_values=1,
-                options=[
-                    discord.SelectOption(label=i, value=i) for i in bm.tags
-                ],
+                options=list(options),
                 custom_id=f'u{bm.id}'
             )
             view.add_item(t_dropdown)
@@ -112,7 +236,13 @@ def get_manage_view(
 def get_bm_embed(bm:api.Message):
     '''
     Returns an embed to show when managing a bookmark.
+
+    Embeds are cached until the bookmark changes.
     '''
+    embed = get_render(('embed', bm.id), bm.version)
+    if embed != None:
+        return embed
+
     # author, send and save time
     send_time = f'<t:{int(bm.sent_at)}:R>'
     save_time = f'<t:{int(bm.saved_at)}:R>'
@@ -149,6 +279,7 @@ def get_bm_embed(bm:api.Message):
             f'\nChannel: {bm.channel_id}'+\
             (f'\nGuild: {bm.guild_id}' if bm.guild_id else '')
     )
+    renders.put(('embed', bm.id), embed, bm.version)
     return embed
 
 # connection events
@@ -157,12 +288,17 @@ def get_bm_embed(bm:api.Message):
 async def on_ready():
     log(f'Ready as {bot.user.name}!')
 
+    if not tasks:
+        tasks.append(asyncio.create_task(metrics.watch_loop()))
+        tasks.append(asyncio.create_task(metrics.write_every(METRICS_FILE)))
+
     # commands = await bot.tree.sync()
     # log(f'Synced tree with {len(commands)} commands', level=SUCCESS)
 
 
 # events
 
+@metrics.timed('bot.handle_modal')
 async def handle_modal(inter:discord.Interaction):
     '''
     Handles modal submitting.
@@ -234,6 +370,45 @@ async def handle_modal(inter:discord.Interaction):
     await inter.response.send_message(embed=embed, ephemeral=True)
 
 
+@metrics.timed('bot.handle_page')
+async def handle_page(inter:discord.Interaction):
+    '''
+    Handles search page buttons.
+
+    Shows a page of a stored search session instead of searching again.
+    '''
+    page, key = inter.data['custom_id'][1:].split(':', 1)
+    session = sessions.get(key)
+
+    if session == None or session[0] != inter.user.id:
+        embed = discord.Embed(
+            color=discord.Color.red(),
+            description='**Search expired!**\n\n'\
+                'Run the search again to see more pages.'
+        )
+        await inter.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    # every bookmark could be removed since searching
+    total = len(session[1]) if session[1] != None else len(mg.get_user(inter.user.id).saved)
+
+    if total == 0:
+        embed = discord.Embed(
+            color=discord.Color.red(),
+            description='**No bookmarks found!**'
+        )
+        await inter.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    embed, elements, page, max_page = get_paginated_embed(
+        int(page), session[1], session[2], inter.user.id
+    )
+    view = get_paginated_view(key, page, max_page, elements)
+
+    await inter.response.edit_message(embed=embed, view=view)
+
+
+@metrics.timed('bot.handle_dropdown')
 async def handle_dropdown(inter:discord.Interaction):
     '''
     Handles dropdown submitting.
@@ -277,6 +452,8 @@ async def handle_dropdown(inter:discord.Interaction):
 
 
 @bot.event
+@metrics.timed('bot.on_interaction')
+@locked
 async def on_interaction(inter:discord.Interaction):
     '''
     Gets called when a button is pressed or a command is used.
@@ -298,6 +475,10 @@ async def on_interaction(inter:discord.Interaction):
         id = int(inter.data['values'][0])
         
     else:
+        if inter.data['custom_id'].startswith('p'):
+            await handle_page(inter)
+            return
+
         action = inter.data['custom_id'][0]
         id = int(inter.data['custom_id'][1:])
 
@@ -413,6 +594,8 @@ async def on_interaction(inter:discord.Interaction):
 
 @bot.tree.context_menu(name='Set note')
 @discord.app_commands.user_install()
+@metrics.timed('bot.note')
+@locked
 async def note(
     inter:discord.Interaction,
     message:discord.Message
@@ -453,6 +636,8 @@ async def note(
 
 @bot.tree.context_menu(name='Bookmark')
 @discord.app_commands.user_install()
+@metrics.timed('bot.bookmark')
+@locked
 async def bookmark(
     inter:discord.Interaction,
     message:discord.Message
@@ -498,12 +683,18 @@ async def bookmark(
 @discord.app_commands.describe(
     prompt='Search prompt. Leave blank to show all.',
     case='Whether the search query is case-sensitive or not.',
+    sort='Order to show the bookmarks in.',
     page='Page to skip to.'
 )
+@metrics.timed('bot.search')
+@locked
 async def view_text(
     inter:discord.Interaction,
     prompt:str='',
     case:Literal['Case sensitive','Case insensitive']='Case insensitive',
+    sort:Literal[
+        'Newest saved','Oldest saved','Newest sent','Author','Most attachments'
+    ]='Newest saved',
     page:int=1
 ):
     '''
@@ -518,48 +709,50 @@ async def view_text(
         await inter.response.send_message(embed=embed, ephemeral=True)
         return
     
-    user = mg.get_user(inter.user.id)
-    search: List[api.Message] = user.search(
-        prompt, case == 'Case sensitive'
-    )
+    sort = SEARCH_SORTS[sort]
+
+    # large searches run in a thread, replying once they are done
+    deferred = mg.offloads(inter.user.id, prompt, sort)
+    respond = inter.followup.send if deferred else inter.response.send_message
+
+    if deferred:
+        await inter.response.defer(ephemeral=True, thinking=True)
+
+    try:
+        results = await mg.match_async(inter.user.id, prompt, case == 'Case sensitive', sort)
+
+    except api.SearchCancelled:
+        embed = discord.Embed(
+            color=discord.Color.red(),
+            description=f'**Search took too long!**\n\n'\
+                f'Try a more specific prompt, searches can take {SEARCH_TIMEOUT} seconds max.'
+        )
+        await respond(embed=embed, ephemeral=True)
+        return
+
+    total = len(results) if results != None else len(mg.get_user(inter.user.id).saved)
 
-    if len(search) == 0:
+    if total == 0:
         embed = discord.Embed(
             color=discord.Color.red(),
             description='**No bookmarks found!**'
         )
 
     else:
-        embed, elements, page = get_paginated_embed(
-            page=page, results=search
-        )
-        elements: List[api.Message]
-        max_page = int(len(search)/PAGE_LEN) + \
-            (1 if len(search)%PAGE_LEN != 0 else 0)
-        
-        # view = get_paginated_view(page, max_page)
-        view = discord.ui.View()
-        
-        dd = discord.ui.Select(
-            placeholder='Manage...',
-            min_values=1,
-            max_values=1,
-            custom_id='b',
-            options=[
-                discord.SelectOption(
-                    label=i.note,
-                    description=f'{i.author_name} - {i.id}',
-                    value=f'{i.id}',
-                ) for i in elements
-            ]
+        key = secrets.token_urlsafe(6)
+        sessions.put(key, (inter.user.id, results, sort))
+
+        embed, elements, page, max_page = get_paginated_embed(
+            page, results, sort, inter.user.id
         )
-        view.add_item(dd)
-        await inter.response.send_message(
+        view = get_paginated_view(key, page, max_page, elements)
+
+        await respond(
             embed=embed, view=view, ephemeral=True
         )
         return
 
-    await inter.response.send_message(embed=embed, ephemeral=True)
+    await respond(embed=embed, ephemeral=True)
 
 
 @bot.tree.command(
@@ -570,6 +763,8 @@ async def view_text(
 @discord.app_commands.describe(
     id='Bookmark ID'
 )
+@metrics.timed('bot.manage')
+@locked
 async def view_text(
     inter:discord.Interaction,
     id:str
@@ -599,6 +794,7 @@ async def view_text(
 
 
 @view_text.autocomplete('id')
+@metrics.timed('bot.manage_autocomplete')
 async def manage_autocomplete(
     inter:discord.Interaction,
     current:str
@@ -606,17 +802,153 @@ async def manage_autocomplete(
     '''
     Autocomplete for manage command.
     '''
-    user = mg.get_user(inter.user.id)
-    
     return [
         discord.app_commands.Choice(
             name=f'{utils.shorten_string(i.note,50)} ({i.id})', value=str(i.id)
-        ) for i in user.saved.values()\
-        if str(i.id).startswith(current) or current == ''
-    ][::-1][:25]
+        ) for i in await mg.complete_async(inter.user.id, current, 25)
+    ]
 
         
 
 
+@bot.tree.command(
+    name='export',
+    description='Download all your bookmarks as a file.'
+)
+@discord.app_commands.user_install()
+@metrics.timed('bot.export')
+@locked
+async def export(
+    inter:discord.Interaction
+):
+    '''
+    Sends the user's bookmarks as a JSON lines file.
+    '''
+    # loading the user here, users are only added from the event loop
+    mg.get_user(inter.user.id)
+    file = await asyncio.to_thread(export_file, inter.user.id)
+    size = file.tell()
+    file.seek(0)
+
+    if size > MAX_EXPORT_SIZE:
+        file.close()
+        embed = discord.Embed(
+            color=discord.Color.red(),
+            description=f'**Too many bookmarks to export!**\n\n'\
+                f'The file would be {size/1024/1024:.1f} MiB, '\
+                f'{MAX_EXPORT_SIZE/1024/1024:.0f} MiB max.'
+        )
+        await inter.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    embed = discord.Embed(
+        color=discord.Color.green(),
+        description='**Bookmarks exported!**\n\n'\
+            'Use `/import` with this file to restore them.'
+    )
+    with file:
+        await inter.response.send_message(
+            embed=embed, ephemeral=True,
+            file=discord.File(file, filename='bookmarks.jsonl')
+        )
+
+
+@bot.tree.command(
+    name='import',
+    description='Import bookmarks from an exported file.'
+)
+@discord.app_commands.user_install()
+@discord.app_commands.describe(
+    file='File made with /export.'
+)
+@metrics.timed('bot.import')
+@locked
+async def import_bookmarks(
+    inter:discord.Interaction,
+    file:discord.Attachment
+):
+    '''
+    Imports bookmarks from a JSON lines file.
+    '''
+    if file.size > MAX_IMPORT_SIZE:
+        embed = discord.Embed(
+            color=discord.Color.red(),
+            description=f'**File too big!**\n\n'\
+                f'{MAX_IMPORT_SIZE/1024/1024:.0f} MiB max.'
+        )
+        await inter.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    await inter.response.defer(ephemeral=True)
+
+    data = await file.read()
+    imported, skipped = await mg.import_async(inter.user.id, data.splitlines())
+
+    embed = discord.Embed(
+        color=discord.Color.green() if imported else discord.Color.red(),
+        description=f'**Imported {imported} bookmarks!**'+\
+            (f'\n\n-# Skipped {skipped} invalid or already saved bookmarks' if skipped else '')
+    )
+    await inter.followup.send(embed=embed, ephemeral=True)
+
+
+@bot.tree.command(
+    name='stats',
+    description='Show bot performance statistics.'
+)
+@discord.app_commands.user_install()
+@metrics.timed('bot.stats')
+async def stats(
+    inter:discord.Interaction
+):
+    '''
+    Shows latency statistics to the bot owner.
+    '''
+    if not await bot.is_owner(inter.user):
+        embed = discord.Embed(
+            color=discord.Color.red(),
+            description='**Only the bot owner can view statistics!**'
+        )
+        await inter.response.send_message(embed=embed, ephemeral=True)
+        return
+
+    operations, gauges = metrics.stats()
+
+    lines = [
+        f'`{name}` ・ {i["count"]} ・ '\
+            f'{i["p50_ms"]:.1f} / {i["p95_ms"]:.1f} / {i["p99_ms"]:.1f} ms'
+        for name, i in sorted(
+            operations.items(), key=lambda x: x[1]['count']*x[1]['mean_ms'], reverse=True
+        )
+    ]
+    desc = '-# Operation ・ Calls ・ p50 / p95 / p99\n'+'\n'.join(lines[:20])
+
+    embed = discord.Embed(
+        color=discord.Color.green(),
+        title='**Statistics**',
+        description=utils.shorten_string(desc, 4000, False)
+    )
+    embed.add_field(
+        name='',
+        value='\n'.join(
+            f'-# {name.replace("_"," ").capitalize()}: {value}'
+            for name, value in gauges.items()
+        )
+    )
+    embed.set_footer(text=f'Up for {int(time.time()-metrics.started)//60} minutes')
+
+    await inter.response.send_message(embed=embed, ephemeral=True)
+
+
 ## RUNNING BOT
-bot.run(TOKEN)
\ No newline at end of file
+# docker and systemd stop the bot with SIGTERM, handling it like
+# Ctrl+C makes the bot close and the pending changes get written
+signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+try:
+    bot.run(TOKEN)
+finally:
+    # not letting another SIGTERM interrupt the final write
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    mg.close()
+    metrics.write(METRICS_FILE)
\ No newline at end of file
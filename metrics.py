@@ -0,0 +1,205 @@
+from typing import *
+
+from config import *
+import asyncio
+import bisect
+import functools
+import os
+import threading
+import time
+
+
+# histograms
+
+BOUNDS = [0.01*1.2**i for i in range(90)] # bucket upper bounds in ms, up to ~130s
+
+
+class Histogram:
+    def __init__(self):
+        '''
+        Latency histogram with exponentially growing buckets.
+
+        Recording is a bisect and an increment, percentiles are
+        accurate to the bucket width, 20% of the value.
+        '''
+        self.buckets: List[int] = [0]*(len(BOUNDS)+1)
+        self.count: int = 0
+        self.total: float = 0
+        self.max: float = 0
+
+
+    def record(self, ms:float):
+        '''
+        Records a value in milliseconds.
+        '''
+        self.buckets[bisect.bisect_left(BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+
+    def percentile(self, q:float) -> float:
+        '''
+        Returns the value in milliseconds below which `q` of the values are.
+        '''
+        if self.count == 0:
+            return 0
+
+        target = q*self.count
+        seen = 0
+
+        for index, i in enumerate(self.buckets):
+            seen += i
+            if seen >= target:
+                return min(BOUNDS[index], self.max) if index < len(BOUNDS) else self.max
+
+        return self.max
+
+
+    def stats(self) -> dict:
+        '''
+        Returns the count and the latency percentiles.
+        '''
+        return {
+            "count": self.count,
+            "mean_ms": self.total/self.count if self.count else 0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max
+        }
+
+
+# metrics
+
+class Metrics:
+    def __init__(self):
+        '''
+        Per-operation latency histograms and gauges.
+
+        Gauges are functions that are called when the metrics are read.
+        '''
+        self.started: float = time.time()
+        self.histograms: Dict[str, Histogram] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+
+    def record(self, name:str, ms:float):
+        '''
+        Records how long an operation took.
+        '''
+        with self.lock:
+            histogram = self.histograms.get(name, None)
+
+            if histogram == None:
+                histogram = self.histograms[name] = Histogram()
+
+            histogram.record(ms)
+
+
+    def timed(self, name:str) -> Callable:
+        '''
+        Decorator that records how long every call of a function
+        or a coroutine function takes.
+        '''
+        def decorator(func:Callable) -> Callable:
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        self.record(name, (time.perf_counter()-start)*1000)
+
+            else:
+                @functools.wraps(func)
+                def wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return func(*args, **kwargs)
+                    finally:
+                        self.record(name, (time.perf_counter()-start)*1000)
+
+            return wrapper
+
+        return decorator
+
+
+    def gauge(self, name:str, func:Callable[[], float]):
+        '''
+        Adds a value that is read when the metrics are read.
+        '''
+        self.gauges[name] = func
+
+
+    def stats(self) -> Tuple[Dict[str, dict], Dict[str, float]]:
+        '''
+        Returns operation statistics and gauge values.
+        '''
+        with self.lock:
+            operations = {k: v.stats() for k, v in sorted(self.histograms.items())}
+
+        gauges = {}
+        for name, func in sorted(self.gauges.items()):
+            try:
+                gauges[name] = func()
+            except Exception:
+                gauges[name] = -1
+
+        return operations, gauges
+
+
+    def dump(self) -> str:
+        '''
+        Returns all metrics as `name value` lines.
+        '''
+        operations, gauges = self.stats()
+        lines = [
+            f'# metrics at {time.time():.0f}',
+            f'uptime_seconds {time.time()-self.started:.0f}'
+        ]
+
+        for name, stats in operations.items():
+            for key, value in stats.items():
+                value = f'{value:.3f}'.rstrip('0').rstrip('.')
+                lines.append(f'{name}_{key} {value}')
+
+        for name, value in gauges.items():
+            lines.append(f'{name} {value}')
+
+        return '\n'.join(lines)+'\n'
+
+
+    def write(self, path:str):
+        '''
+        Writes the metrics dump to a file.
+        '''
+        with open(path+'.tmp', 'w', encoding='utf-8') as f:
+            f.write(self.dump())
+
+        os.replace(path+'.tmp', path)
+
+
+    async def watch_loop(self, interval:float=LOOP_LAG_INTERVAL):
+        '''
+        Records how late the event loop wakes up from sleeping,
+        which is how long something was blocking it.
+        '''
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.record('loop_lag', max(time.perf_counter()-start-interval, 0)*1000)
+
+
+    async def write_every(self, path:str, interval:float=METRICS_INTERVAL):
+        '''
+        Writes the metrics dump to a file every `interval` seconds.
+        '''
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.write, path)
+
+
+metrics = Metrics()
@@ -0,0 +1,30 @@
+from config import *
+from log import *
+import storage
+import sys
+
+
+# migrating
+
+def migrate(users_file:str, users_db:str):
+    '''
+    Imports an existing JSON user database into an SQLite one.
+    '''
+    source = storage.FileStorage(users_file)
+    target = storage.SqliteStorage(users_db)
+
+    users = source.load()
+    target.save(users.items())
+    target.close()
+
+    bookmarks = sum(len(i.get('saved', {})) for i in users.values())
+    log(f'Imported {len(users)} users and {bookmarks} bookmarks into {users_db}',
+        'migrate', SUCCESS)
+
+
+## RUNNING
+if __name__ == '__main__':
+    migrate(
+        sys.argv[1] if len(sys.argv) > 1 else USERS_FILE,
+        sys.argv[2] if len(sys.argv) > 2 else USERS_DB
+    )
@@ -0,0 +1,917 @@
+from typing import *
+
+from config import *
+import json
+import os
+import sqlite3
+import threading
+from formats import Format, get_format, detect_format
+from log import *
+
+
+# storage backends
+
+class Storage:
+    def __init__(self, path:str):
+        '''
+        Base class for user data storage backends.
+
+        Backends receive every mutation through `write` and full snapshots
+        through `save`. User data is passed around as plain dicts in the same
+        format `User.to_dict` returns.
+        '''
+        self.path: str = path
+
+
+    def load(self) -> Dict[int, dict]:
+        '''
+        Loads all users from the storage.
+
+        Raises an exception if the storage is damaged.
+        '''
+        raise NotImplementedError
+
+
+    def iter_users(self) -> Iterator[Tuple[int, dict]]:
+        '''
+        Loads users from the storage one by one, so only one
+        of them has to be in memory as a dict at a time.
+
+        Raises an exception if the storage is damaged, in which
+        case `load` should be used to recover.
+        '''
+        yield from self.load().items()
+
+
+    def load_index(self) -> bool:
+        '''
+        Prepares the storage for loading users one by one.
+
+        Returns False if the storage has to be loaded fully instead.
+        '''
+        return False
+
+
+    def stored(self, id:int) -> bool:
+        '''
+        Returns whether the storage has an up-to-date copy of the user,
+        so `save` can keep it without the user being passed in.
+        '''
+        return False
+
+
+    def durable_writes(self) -> bool:
+        '''
+        Returns whether `write` stores mutations for good, so users
+        only changed through it never have to be saved again.
+        '''
+        return False
+
+
+    def load_user(self, id:int) -> "dict | None":
+        '''
+        Loads a single user from the storage.
+
+        Returns None if the user is not stored.
+        '''
+        raise NotImplementedError
+
+
+    def save(self, users:Iterable[Tuple[int, dict]]):
+        '''
+        Stores the given users.
+
+        Users that are not passed in are kept as they are.
+        '''
+        raise NotImplementedError
+
+
+    def write(self, op:str, user:int, message:int, data:Any=None) -> bool:
+        '''
+        Stores a single mutation.
+
+        Returns whether the backend wants a full snapshot to be saved.
+        '''
+        raise NotImplementedError
+
+
+    def files(self) -> List[str]:
+        '''
+        Returns paths of the files the storage keeps its data in.
+        '''
+        return [self.path]
+
+
+    def size(self) -> int:
+        '''
+        Returns how many bytes the storage takes up on disk.
+        '''
+        return sum(os.path.getsize(i) for i in self.files() if os.path.exists(i))
+
+
+    def panic(self):
+        '''
+        Moves the damaged storage out of the way.
+        '''
+        if os.path.exists(self.path):
+            os.replace(self.path, self.path+'.bak')
+            log(f'Cloned user data file to {self.path}.bak', 'storage')
+
+
+    def close(self):
+        '''
+        Releases all resources held by the storage.
+        '''
+        pass
+
+
+def apply(users:Dict[int, dict], op:str, user:int, message:int, data:Any=None):
+    '''
+    Applies a single mutation to user data dicts.
+    '''
+    saved: dict = users.setdefault(user, {}).setdefault('saved', {})
+    id = str(message)
+
+    if op == 'bookmark':
+        saved[id] = data
+        return
+
+    if id not in saved:
+        return
+    bm: dict = saved[id]
+
+    if op == 'note':
+        bm['note'] = data
+
+    elif op == 'add_tag':
+        tags: List[str] = bm.setdefault('tags', [])
+        if data not in tags:
+            tags.append(data)
+
+    elif op == 'remove_tag':
+        tags: List[str] = bm.setdefault('tags', [])
+        if data in tags:
+            tags.remove(data)
+
+    elif op == 'remove':
+        saved.pop(id)
+
+
+def sync_dir(path:str):
+    '''
+    Makes sure renames in the directory of the file are on disk.
+
+    Does nothing on systems that can't open directories.
+    '''
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class FileStorage(Storage):
+    def __init__(self, path:str, format:str=SNAPSHOT_FORMAT):
+        '''
+        Stores users in a single snapshot file.
+
+        Snapshots are written in the given format, the format of an existing
+        snapshot is detected when it is read.
+
+        Every mutation is appended to a journal file next to the database
+        and the database itself is only rewritten when the journal is compacted.
+
+        Next to every snapshot an index file with the position of each user
+        in it is written, so users can be read one by one.
+        '''
+        super().__init__(path)
+        self.journal_file: str = path+'.journal'
+        self.journal_len: int = 0
+        self.index_file: str = path+'.idx'
+        self.format: Format = get_format(format)
+        self.file_format: Format = self.format # format of the current snapshot
+
+        self.lock: threading.Lock = threading.Lock() # guards the snapshot and the index
+        self.index: Dict[int, Tuple[int, int]] = {}
+        self.pending: Dict[int, List[dict]] = {}
+
+
+    def files(self) -> List[str]:
+        return [self.path, self.journal_file, self.index_file]
+
+
+    def generations(self) -> List[str]:
+        '''
+        Returns paths of the database and its backups, newest first.
+        '''
+        return [self.path]+[f'{self.path}.{i}' for i in range(1, SNAPSHOT_BACKUPS+1)]
+
+
+    def load(self) -> Dict[int, dict]:
+        users = None
+
+        for path in self.generations():
+            if not os.path.exists(path):
+                continue
+
+            try:
+                format = detect_format(path)
+                with open(path, 'rb') as f:
+                    users = format.load(f)
+
+                self.file_format = format
+                break
+
+            except Exception as e:
+                log(f'Unable to load {path}: {e}', 'storage', ERROR)
+
+        if users == None:
+            raise FileNotFoundError(f'No valid snapshot of {self.path} found')
+
+        if path != self.path:
+            log(f'Recovered user data from {path}', 'storage', WARNING)
+        else:
+            self.read_index()
+
+        # journal
+        self.replay(users)
+
+        if self.journal_len > 0:
+            self.save(users.items())
+
+        return users
+
+
+    def iter_users(self) -> Iterator[Tuple[int, dict]]:
+        '''
+        Streams users from the current snapshot. With an index, users are
+        read by their positions, otherwise the snapshot is parsed incrementally.
+
+        Journal records are applied to each user as they are read and are
+        only compacted into the snapshot by the next save.
+        '''
+        with self.lock:
+            indexed = self.load_index()
+
+            if not indexed:
+                records = self.read_journal()
+                self.journal_len = len(records)
+                self.index = {}
+                self.pending = {}
+                self.file_format = detect_format(self.path)
+
+                for i in records:
+                    self.pending.setdefault(i['user'], []).append(i)
+
+            index = dict(self.index)
+            pending = dict(self.pending)
+            format = self.file_format
+
+        with open(self.path, 'rb') as f:
+            if indexed:
+                # reading in file order
+                users = (
+                    (id, self.read(f, id, index, {}, format))
+                    for id in sorted(index, key=lambda i: index[i][0])
+                )
+            else:
+                users = format.iter_load(f)
+
+            for id, user in users:
+                data = {id: user}
+                for i in pending.pop(id, []):
+                    apply(data, i['op'], i['user'], i['id'], i.get('data', None))
+
+                yield id, data[id]
+
+        # users that are only in the journal
+        for id in list(pending):
+            yield id, self.read(None, id, {}, pending, format)
+
+
+    def read_journal(self) -> List[dict]:
+        '''
+        Returns all records from the journal.
+        '''
+        records = []
+
+        if not os.path.exists(self.journal_file):
+            return records
+
+        with open(self.journal_file, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except:
+                    # only the last record can be torn by a crash
+                    log('Skipped a broken journal record', 'storage', WARNING)
+
+        return records
+
+
+    def replay(self, users:Dict[int, dict]):
+        '''
+        Applies all mutations from the journal that are not in the database yet.
+        '''
+        records = self.read_journal()
+        self.journal_len = len(records)
+
+        for i in records:
+            apply(users, i['op'], i['user'], i['id'], i.get('data', None))
+
+        if self.journal_len > 0:
+            log(f'Replayed {self.journal_len} journal records', 'storage')
+
+
+    def read_index(self) -> bool:
+        '''
+        Reads the positions of users in the current snapshot.
+
+        Returns whether the index matches the snapshot.
+        '''
+        if not os.path.exists(self.index_file):
+            return False
+
+        try:
+            with open(self.index_file, encoding='utf-8') as f:
+                data = json.load(f)
+
+            if data['size'] != os.path.getsize(self.path):
+                log('Index does not match the snapshot', 'storage', WARNING)
+                return False
+
+            self.index = {int(id): tuple(pos) for id, pos in data['users'].items()}
+            self.file_format = get_format(data.get('format', 'json'))
+
+        except Exception as e:
+            log(f'Unable to load the index: {e}', 'storage', WARNING)
+            return False
+
+        return True
+
+
+    def load_index(self) -> bool:
+        if not self.read_index():
+            return False
+
+        # journal records are applied once their user is loaded
+        records = self.read_journal()
+        self.journal_len = len(records)
+        self.pending = {}
+
+        for i in records:
+            self.pending.setdefault(i['user'], []).append(i)
+
+        return True
+
+
+    def read(
+        self, file:"BinaryIO | None", id:int,
+        index:Dict[int, Tuple[int, int]], pending:Dict[int, List[dict]],
+        format:Format
+    ) -> "dict | None":
+        '''
+        Reads a user from a snapshot file and applies their journal records.
+        '''
+        if id not in index and id not in pending:
+            return None
+
+        users: Dict[int, dict] = {id: {}}
+
+        if id in index:
+            offset, length = index[id]
+            file.seek(offset)
+            users[id] = format.loads(file.read(length))
+
+        for i in pending.get(id, []):
+            apply(users, i['op'], i['user'], i['id'], i.get('data', None))
+
+        return users[id]
+
+
+    def load_user(self, id:int) -> "dict | None":
+        with self.lock:
+            if id in self.index:
+                with open(self.path, 'rb') as f:
+                    user = self.read(f, id, self.index, self.pending, self.file_format)
+            else:
+                user = self.read(None, id, self.index, self.pending, self.file_format)
+
+        return user
+
+
+    def stored(self, id:int) -> bool:
+        # journal records are only in the snapshot after the next save
+        with self.lock:
+            return id in self.index and id not in self.pending
+
+
+    def save(self, users:Iterable[Tuple[int, dict]]):
+        '''
+        Writes a snapshot to a temporary file and puts it in place of the
+        database once it is fully on disk.
+
+        Users that are in the storage but not passed in are copied from the
+        current snapshot. The previous snapshots are kept as numbered backups.
+        '''
+        temp = self.path+'.tmp'
+        index: Dict[int, Tuple[int, int]] = {}
+
+        format = self.format
+
+        with self.lock:
+            old_index = dict(self.index)
+            old_format = self.file_format
+            pending = dict(self.pending)
+
+        with open(temp, 'wb') as f:
+            f.write(format.header())
+
+            def put(id:int, fragment:bytes):
+                f.write(format.record(id, len(fragment), not index))
+                index[id] = (f.tell(), len(fragment))
+                f.write(fragment)
+
+            # writing one user at a time
+            for id, user in users:
+                put(id, format.dumps(user))
+
+            # users that are not loaded
+            rest = [i for i in old_index.keys() | pending.keys() if i not in index]
+
+            if rest:
+                with open(self.path, 'rb') as old:
+                    for id in rest:
+                        if id in pending or old_format.name != format.name:
+                            user = self.read(old, id, old_index, pending, old_format)
+                            put(id, format.dumps(user))
+                        else:
+                            offset, length = old_index[id]
+                            old.seek(offset)
+                            put(id, old.read(length))
+
+            f.write(format.footer())
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+
+        with self.lock:
+            # rotating backups
+            paths = self.generations()
+
+            for old, new in reversed(list(zip(paths[1:-1], paths[2:]))):
+                if os.path.exists(old):
+                    os.replace(old, new)
+
+            if os.path.exists(self.path) and len(paths) > 1:
+                os.replace(self.path, paths[1])
+
+            os.replace(temp, self.path)
+
+            # index
+            with open(self.index_file+'.tmp', 'w', encoding='utf-8') as f:
+                json.dump({'size': size, 'format': format.name, 'users': index}, f)
+            os.replace(self.index_file+'.tmp', self.index_file)
+            sync_dir(self.path)
+
+            self.index = index
+            self.file_format = format
+            for i in pending:
+                self.pending.pop(i, None)
+
+        # clearing journal
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self.journal_len = 0
+
+
+    def write(self, op:str, user:int, message:int, data:Any=None) -> bool:
+        record = {'op': op, 'user': user, 'id': message}
+        if data != None:
+            record['data'] = data
+
+        with open(self.journal_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False)+'\n')
+
+        self.journal_len += 1
+        return self.journal_len >= JOURNAL_LIMIT
+
+
+    def panic(self):
+        super().panic()
+
+        if os.path.exists(self.journal_file):
+            os.replace(self.journal_file, self.journal_file+'.bak')
+            log(f'Cloned journal to {self.journal_file}.bak', 'storage')
+
+        with self.lock:
+            self.index = {}
+            self.pending = {}
+
+
+class SqliteStorage(Storage):
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS bookmarks (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            id INTEGER NOT NULL,
+            link TEXT NOT NULL,
+            text TEXT NOT NULL,
+            note TEXT NOT NULL,
+            saved_at REAL NOT NULL,
+            sent_at REAL NOT NULL,
+            guild_id INTEGER,
+            channel_id INTEGER NOT NULL,
+            author TEXT NOT NULL,
+            author_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, id)
+        );
+        CREATE TABLE IF NOT EXISTS tags (
+            user_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            tag TEXT NOT NULL,
+            PRIMARY KEY (user_id, message_id, tag),
+            FOREIGN KEY (user_id, message_id)
+                REFERENCES bookmarks(user_id, id) ON DELETE CASCADE
+        );
+        CREATE TABLE IF NOT EXISTS attachments (
+            user_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            extension TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            url TEXT NOT NULL,
+            FOREIGN KEY (user_id, message_id)
+                REFERENCES bookmarks(user_id, id) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS bookmarks_user ON bookmarks(user_id);
+        CREATE INDEX IF NOT EXISTS bookmarks_author ON bookmarks(user_id, author_id);
+        CREATE INDEX IF NOT EXISTS bookmarks_guild ON bookmarks(user_id, guild_id);
+        CREATE INDEX IF NOT EXISTS bookmarks_channel ON bookmarks(user_id, channel_id);
+        CREATE INDEX IF NOT EXISTS bookmarks_sent ON bookmarks(user_id, sent_at);
+        CREATE INDEX IF NOT EXISTS tags_message ON tags(user_id, message_id);
+        CREATE INDEX IF NOT EXISTS attachments_message ON attachments(user_id, message_id);
+    '''
+
+    def __init__(self, path:str):
+        '''
+        Stores users in an SQLite database.
+
+        Every mutation touches only the rows of the affected bookmark.
+        '''
+        super().__init__(path)
+        self.lock: threading.Lock = threading.Lock() # guards the connection
+        self.db: sqlite3.Connection = self.connect()
+
+
+    def connect(self) -> sqlite3.Connection:
+        '''
+        Opens the database and creates the tables if needed.
+        '''
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute('PRAGMA foreign_keys = ON')
+        db.execute('PRAGMA journal_mode = WAL')
+        db.executescript(self.SCHEMA)
+        return db
+
+
+    def files(self) -> List[str]:
+        return [self.path, self.path+'-wal']
+
+
+    def select(self, where:str='', params:tuple=()) -> Dict[int, dict]:
+        '''
+        Reads users and all their bookmarks.
+
+        `where` is an SQL condition on `user_id` shared by all queried tables.
+        '''
+        users: Dict[int, dict] = {
+            id: {'saved': {}} for id, in self.db.execute(
+                'SELECT id AS user_id FROM users '+where, params
+            )
+        }
+
+        # bookmarks
+        rows = self.db.execute(
+            'SELECT user_id, id, link, text, note, saved_at, sent_at, guild_id,'
+            ' channel_id, author, author_id FROM bookmarks '+where+' ORDER BY rowid',
+            params
+        )
+        for user, id, link, text, note, saved_at, sent_at, guild_id,\
+        channel_id, author, author_id in rows:
+            users[user]['saved'][str(id)] = {
+                "link": link,
+                "text": text,
+                "note": note,
+                "saved_at": saved_at,
+                "sent_at": sent_at,
+                "tags": [],
+                "guild_id": guild_id,
+                "channel_id": channel_id,
+                "attachments": [],
+                "author": author,
+                "author_id": author_id
+            }
+
+        # tags
+        rows = self.db.execute(
+            'SELECT user_id, message_id, tag FROM tags '+where+' ORDER BY rowid',
+            params
+        )
+        for user, id, tag in rows:
+            users[user]['saved'][str(id)]['tags'].append(tag)
+
+        # attachments
+        rows = self.db.execute(
+            'SELECT user_id, message_id, id, type, extension, filename, url'
+            ' FROM attachments '+where+' ORDER BY rowid', params
+        )
+        for user, message, id, type, extension, filename, url in rows:
+            users[user]['saved'][str(message)]['attachments'].append({
+                "id": id,
+                "type": type,
+                "extension": extension,
+                "filename": filename,
+                "url": url
+            })
+
+        return users
+
+
+    def load(self) -> Dict[int, dict]:
+        with self.lock:
+            return self.select()
+
+
+    def iter_users(self) -> Iterator[Tuple[int, dict]]:
+        with self.lock:
+            ids = [id for id, in self.db.execute('SELECT id FROM users')]
+
+        for id in ids:
+            user = self.load_user(id)
+            if user != None:
+                yield id, user
+
+
+    def load_index(self) -> bool:
+        return True
+
+
+    def load_user(self, id:int) -> "dict | None":
+        with self.lock:
+            return self.select('WHERE user_id = ?', (id,)).get(id, None)
+
+
+    def stored(self, id:int) -> bool:
+        # every mutation is written to the database right away
+        return True
+
+
+    def durable_writes(self) -> bool:
+        return True
+
+
+    def insert(self, user:int, message:int, data:dict):
+        '''
+        Inserts a bookmark with its tags and attachments.
+        '''
+        self.db.execute('INSERT OR IGNORE INTO users (id) VALUES (?)', (user,))
+        self.db.execute(
+            'INSERT INTO bookmarks (user_id, id, link, text, note, saved_at,'
+            ' sent_at, guild_id, channel_id, author, author_id)'
+            ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                user, message, data['link'], data.get('text', ''),
+                data.get('note', '...'), data['saved_at'], data['sent_at'],
+                data.get('guild_id', None), data['channel_id'],
+                data['author'], data['author_id']
+            )
+        )
+        self.db.executemany(
+            'INSERT OR IGNORE INTO tags (user_id, message_id, tag) VALUES (?, ?, ?)',
+            [(user, message, i) for i in data.get('tags', [])]
+        )
+        self.db.executemany(
+            'INSERT INTO attachments (user_id, message_id, id, type, extension,'
+            ' filename, url) VALUES (?, ?, ?, ?, ?, ?, ?)', [(
+                user, message, i['id'], i.get('type', 'none'),
+                i.get('extension', 'none'), i['filename'], i['url']
+            ) for i in data.get('attachments', [])]
+        )
+
+
+    def save(self, users:Iterable[Tuple[int, dict]]):
+        with self.lock, self.db:
+            for id, user in users:
+                self.db.execute('DELETE FROM users WHERE id = ?', (id,))
+                self.db.execute('INSERT INTO users (id) VALUES (?)', (id,))
+
+                for message, data in user.get('saved', {}).items():
+                    self.insert(id, int(message), data)
+
+
+    def write(self, op:str, user:int, message:int, data:Any=None) -> bool:
+        with self.lock, self.db:
+            if op == 'bookmark':
+                self.insert(user, message, data)
+
+            elif op == 'note':
+                self.db.execute(
+                    'UPDATE bookmarks SET note = ? WHERE user_id = ? AND id = ?',
+                    (data, user, message)
+                )
+
+            elif op == 'add_tag':
+                self.db.execute(
+                    'INSERT OR IGNORE INTO tags (user_id, message_id, tag) VALUES (?, ?, ?)',
+                    (user, message, data)
+                )
+
+            elif op == 'remove_tag':
+                self.db.execute(
+                    'DELETE FROM tags WHERE user_id = ? AND message_id = ? AND tag = ?',
+                    (user, message, data)
+                )
+
+            elif op == 'remove':
+                self.db.execute(
+                    'DELETE FROM bookmarks WHERE user_id = ? AND id = ?',
+                    (user, message)
+                )
+
+        return False
+
+
+    def panic(self):
+        self.db.close()
+        super().panic()
+        self.db = self.connect()
+
+
+    def close(self):
+        self.db.close()
+
+
+# writing
+
+def merge(
+    old:"List[Tuple[int, dict]] | None", new:"List[Tuple[int, dict]] | None"
+) -> "List[Tuple[int, dict]] | None":
+    '''
+    Merges two snapshots, users in the newer one replace users in the older one.
+    '''
+    if old == None or new == None:
+        return new if old == None else old
+
+    users = dict(old)
+    users.update(new)
+    return list(users.items())
+
+
+class Writer:
+    def __init__(self, storage:Storage, durability:str=DURABILITY, interval:int=FLUSH_INTERVAL):
+        '''
+        Passes mutations and snapshots to the storage.
+
+        In `immediate` mode everything is written before the call returns.
+        In `batched` mode the data is queued and a worker thread writes it
+        at most once every `interval` milliseconds. Queued data is never
+        changed after it is passed in, so the worker does not have to look
+        at live objects.
+        '''
+        self.storage: Storage = storage
+        self.durability: str = durability
+        self.interval: float = interval/1000
+
+        self.pending: List[Tuple[str, int, int, Any]] = []
+        self.snapshot: "List[Tuple[int, dict]] | None" = None
+        self.wants_snapshot: bool = False
+
+        self.lock: threading.Lock = threading.Lock() # guards the queue
+        self.flush_lock: threading.Lock = threading.Lock() # guards the storage
+        self.dirty: threading.Event = threading.Event()
+        self.closed: threading.Event = threading.Event()
+
+        self.thread: "threading.Thread | None" = None
+        if durability == 'batched':
+            self.thread = threading.Thread(target=self.run, name='writer', daemon=True)
+            self.thread.start()
+
+
+    def write(self, op:str, user:int, message:int, data:Any=None):
+        '''
+        Queues a single mutation.
+        '''
+        with self.lock:
+            self.pending.append((op, user, message, data))
+
+        self.schedule()
+
+
+    def save(self, users:List[Tuple[int, dict]]):
+        '''
+        Queues a snapshot.
+
+        Mutations of the users in it queued before it are dropped since
+        the snapshot has them. If an older snapshot is still queued,
+        the two are merged.
+        '''
+        saved = {id for id, _ in users}
+
+        with self.lock:
+            self.snapshot = merge(self.snapshot, users)
+            self.pending = [i for i in self.pending if i[1] not in saved]
+            self.wants_snapshot = False
+
+        self.schedule()
+
+
+    def schedule(self):
+        '''
+        Writes the queue now or wakes the worker up, depending on the mode.
+        '''
+        if self.thread == None:
+            self.flush()
+        else:
+            self.dirty.set()
+
+
+    def flush(self):
+        '''
+        Writes everything that is queued.
+        '''
+        with self.flush_lock:
+            with self.lock:
+                snapshot, self.snapshot = self.snapshot, None
+                pending, self.pending = self.pending, []
+
+            done = 0
+
+            try:
+                if snapshot != None:
+                    self.storage.save(snapshot)
+                    snapshot = None
+
+                for op, user, message, data in pending:
+                    if self.storage.write(op, user, message, data):
+                        self.wants_snapshot = True
+                    done += 1
+
+            except Exception as e:
+                log(f'Unable to write user data: {e}', 'storage', ERROR)
+
+                # putting the rest back to retry later,
+                # a newer snapshot already has the mutations of its users
+                with self.lock:
+                    saved = {id for id, _ in self.snapshot or []}
+                    self.pending = [
+                        i for i in pending[done:] if i[1] not in saved
+                    ] + self.pending
+                    self.snapshot = merge(snapshot, self.snapshot)
+
+
+    def run(self):
+        '''
+        Worker thread loop.
+        '''
+        while not self.closed.is_set():
+            self.dirty.wait()
+
+            # letting more mutations pile up
+            self.closed.wait(self.interval)
+            self.dirty.clear()
+            self.flush()
+
+
+    def close(self):
+        '''
+        Stops the worker and writes everything that is left.
+        '''
+        self.closed.set()
+        self.dirty.set()
+
+        if self.thread != None:
+            self.thread.join()
+
+        self.flush()
+        self.storage.close()
+
+
+def get_storage(backend:str, path:str) -> Storage:
+    '''
+    Returns a storage backend by its name.
+    '''
+    if backend == 'file':
+        return FileStorage(path)
+    if backend == 'sqlite':
+        return SqliteStorage(path)
+
+    raise ValueError(f'Unknown storage backend: {backend}')
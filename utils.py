@@ -1,7 +1,9 @@
 from typing import *
 
 import time
+import datetime
 import random
+import re
 
 
 # functions
@@ -60,3 +62,54 @@ def rand_id(k:int=4) -> str:
                                                              # after the timestamp
     string = hex(int(timestamp+random_part))[2:] # converting the number to hex to make it shorter
     return string
+
+
+TIME_UNITS = {
+    's': 1, 'm': 60, 'h': 60*60, 'd': 24*60*60,
+    'w': 7*24*60*60, 'mo': 30*24*60*60, 'y': 365*24*60*60
+}
+
+def relative_time(string:str) -> "float | None":
+    '''
+    Converts a time ago like `7d` or `2.5h` to a timestamp.
+
+    Returns None if the string is not a time ago.
+    '''
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)(s|m|h|d|w|mo|y)', string.strip().lower())
+    if match == None:
+        return None
+
+    return time.time()-float(match[1])*TIME_UNITS[match[2]]
+
+
+def parse_time(string:str) -> "float | None":
+    '''
+    Converts a time ago, an ISO date or a Unix timestamp to a timestamp.
+
+    Dates without a time zone are in UTC. Years like `2024` and basic
+    ISO dates like `20240101` are dates, not timestamps from 1970.
+    Returns None if the string is not a time.
+    '''
+    out = relative_time(string)
+    if out != None:
+        return out
+
+    string = string.strip()
+
+    try:
+        if re.fullmatch(r'\d{4}|\d{8}', string):
+            date = datetime.datetime.strptime(string, '%Y' if len(string) == 4 else '%Y%m%d')
+
+        elif re.fullmatch(r'\d+(?:\.\d+)?', string):
+            return float(string)
+
+        else:
+            date = datetime.datetime.fromisoformat(string.upper())
+
+    except ValueError:
+        return None
+
+    if date.tzinfo == None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+
+    return date.timestamp()